@@ -0,0 +1,116 @@
+"""A local stand-in for the parts of the reddit API the scraper uses: the OAuth token endpoint,
+subreddit name search and the hot/new/top/controversial listings (with after/before paging).
+Every subreddit has the same synthetic posts, a configurable share of which link to images
+on the local image servers, spread evenly over them. Counts the API calls it answers."""
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+LISTING_PATH = re.compile(r'^/r/([^/]+)/(hot|new|top|controversial)/?$')
+IMAGE_EXTENSIONS = ('jpg', 'png', 'gif')
+
+class FakeReddit:
+
+    def __init__(self, image_base_urls, posts: int = 5000, image_ratio: float = 0.5, latency: float = 0.0):
+        # one url, or a list of them: the image hosts, which the download engine limits separately
+        if isinstance(image_base_urls, str):
+            image_base_urls = [image_base_urls]
+        self.image_base_urls = [url.rstrip('/') for url in image_base_urls]
+        self.posts = posts
+        self.image_ratio = image_ratio
+        self.latency = latency
+        self.calls = {'token': 0, 'search': 0, 'listing': 0}
+        self._lock = threading.Lock()
+        self._server = None
+        self._created = time.time()
+
+    def post(self, sub: str, i: int) -> dict:
+        """The i-th newest post of sub. Posts with an image are spread evenly through the listing."""
+        post_id = '{:x}'.format(0x100000 + i)
+        is_image = int((i + 1) * self.image_ratio) != int(i * self.image_ratio)
+        if is_image:
+            url = '{}/img/{}_{}.{}'.format(self.image_base_urls[i % len(self.image_base_urls)], sub, post_id,
+                                           IMAGE_EXTENSIONS[i % 3])
+        else:
+            url = 'https://www.reddit.com/r/{}/comments/{}/'.format(sub, post_id)
+        return {'id': post_id, 'name': 't3_' + post_id, 'title': 'Post {}'.format(i), 'author': 'bench',
+                'subreddit': sub, 'score': self.posts - i, 'num_comments': i % 50,
+                'created_utc': self._created - 60 * i, 'url': url, 'domain': urlsplit(url).netloc,
+                'permalink': '/r/{}/comments/{}/'.format(sub, post_id), 'over_18': False, 'is_video': False}
+
+    def _index(self, fullname: str) -> int:
+        return int(fullname.split('_')[-1], 16) - 0x100000
+
+    def listing(self, sub: str, query: dict) -> dict:
+        limit = min(int(query.get('limit', ['25'])[0]), 100)
+        if 'before' in query:
+            end = self._index(query['before'][0])
+            start = max(end - limit, 0)
+        else:
+            start = self._index(query['after'][0]) + 1 if 'after' in query else 0
+            end = min(start + limit, self.posts)
+        children = [{'kind': 't3', 'data': self.post(sub, i)} for i in range(start, end)]
+        return {'kind': 'Listing', 'data': {
+            'after': children[-1]['data']['name'] if children and end < self.posts else None,
+            'before': children[0]['data']['name'] if children and start > 0 else None,
+            'dist': len(children), 'children': children}}
+
+    def start(self) -> str:
+        """Starts serving on a free localhost port in a background thread, returns the base url."""
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def _send_json(self, data, status=200):
+                body = json.dumps(data).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _count(self, kind):
+                with fake._lock:
+                    fake.calls[kind] += 1
+                if fake.latency:
+                    time.sleep(fake.latency)
+
+            def do_POST(self):
+                parts = urlsplit(self.path)
+                length = int(self.headers.get('Content-Length', 0))
+                form = parse_qs(self.rfile.read(length).decode('utf-8'))
+                if parts.path == '/api/v1/access_token':
+                    self._count('token')
+                    self._send_json({'access_token': 'benchmark', 'token_type': 'bearer',
+                                     'expires_in': 3600, 'scope': '*'})
+                elif parts.path.rstrip('/') == '/api/search_reddit_names':
+                    self._count('search')
+                    self._send_json({'names': form.get('query', [])})
+                else:
+                    self._send_json({'error': 404}, 404)
+
+            def do_GET(self):
+                parts = urlsplit(self.path)
+                match = LISTING_PATH.match(parts.path)
+                if match:
+                    self._count('listing')
+                    self._send_json(fake.listing(match.group(1), parse_qs(parts.query)))
+                else:
+                    self._send_json({'error': 404}, 404)
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return 'http://127.0.0.1:{}'.format(self._server.server_address[1])
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
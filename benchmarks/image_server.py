@@ -0,0 +1,80 @@
+"""Local HTTP server for synthetic JPG/PNG/GIF images of a configurable size, with optional
+per-request latency and a rate of 503 errors. Every url gets different bytes (a unique tail after
+the image data, which decoders ignore), so the dedup index does not short-circuit downloads."""
+import io
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+from PIL import Image
+
+FORMATS = {'jpg': ('JPEG', 'image/jpeg'), 'png': ('PNG', 'image/png'), 'gif': ('GIF', 'image/gif')}
+
+def synthetic_image(fmt: str, size: int) -> bytes:
+    """A decodable image of roughly size bytes: noise, whose dimensions are grown until it is big enough."""
+    side = 64
+    rng = random.Random(fmt)
+    while True:
+        img = Image.frombytes('RGB', (side, side), rng.randbytes(side * side * 3))
+        buffer = io.BytesIO()
+        img.save(buffer, FORMATS[fmt][0])
+        data = buffer.getvalue()
+        if len(data) >= size or side >= 4096:
+            return data
+        side = int(side * max(1.2, (size / len(data)) ** 0.5))
+
+class ImageServer:
+
+    def __init__(self, image_size: int = 200 * 1024, latency: float = 0.0, error_rate: float = 0.0, seed: int = 0):
+        self.image_size = image_size
+        self.latency = latency
+        self.error_rate = error_rate
+        self.requests = 0
+        self.errors = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._images = {fmt: synthetic_image(fmt, image_size) for fmt in FORMATS}
+        self._server = None
+
+    def start(self) -> str:
+        """Starts serving on a free localhost port in a background thread, returns the base url."""
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                path = urlsplit(self.path).path
+                fmt = path.rsplit('.', 1)[-1]
+                with server._lock:
+                    server.requests += 1
+                    fail = server._random.random() < server.error_rate
+                    server.errors += fail
+                if server.latency:
+                    time.sleep(server.latency)
+                if fail or fmt not in FORMATS or not path.startswith('/img/'):
+                    self.send_response(503 if fail else 404)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                body = server._images[fmt] + path.encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', FORMATS[fmt][1])
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return 'http://127.0.0.1:{}'.format(self._server.server_address[1])
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
@@ -0,0 +1,194 @@
+"""Offline benchmarks of the listing + download pipeline, against a fake reddit API and a local image server.
+
+    python benchmarks/run_benchmarks.py              # run every scenario, save and compare with the last saved run
+    python benchmarks/run_benchmarks.py workers-1 workers-16
+    python benchmarks/run_benchmarks.py --list
+
+Every scenario runs in its own process, so that its peak RSS is its own, and the fake reddit and
+the image server run in another one, so that they neither count towards that RSS nor compete with
+the scraper for the GIL. Reported per scenario:
+images/sec, time to first image, peak RSS and the number of reddit API calls. Results are saved
+in benchmarks/results/, named by date and git revision, and compared with the previous file there."""
+import argparse
+import collections
+import datetime
+import glob
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARK_FOLDER = os.path.dirname(os.path.abspath(__file__))
+RESULTS_FOLDER = os.path.join(BENCHMARK_FOLDER, 'results')
+sys.path.insert(0, os.path.dirname(BENCHMARK_FOLDER))
+
+# image_hosts image servers on ports of their own, like reddit's mix of i.redd.it, i.imgur.com and others;
+# the download engine allows 4 requests per host at a time, so with one host more workers would not help
+DEFAULTS = dict(subreddits=1, num=100, sorting='Hot', workers=8, concurrent_jobs=4, posts=5000, image_ratio=0.5,
+                image_size=200 * 1024, image_latency=0.02, api_latency=0.05, error_rate=0.0, image_hosts=4)
+SCENARIOS = {
+    'single-hot': dict(),
+    'image-poor': dict(num=50, image_ratio=0.05),
+    'workers-1': dict(workers=1, image_latency=0.05),
+    'workers-4': dict(workers=4, image_latency=0.05),
+    'workers-16': dict(workers=16, image_latency=0.05),
+    'flaky-host': dict(error_rate=0.1),
+    'many-subreddits': dict(subreddits=10, num=20),
+    'large-files': dict(num=20, image_size=8 * 1024 * 1024, image_latency=0.0),
+}
+# compared between runs; for the first one higher is better, for the rest lower is better
+COMPARED = ('images_per_sec', 'time_to_first_image', 'peak_rss_mb', 'api_calls')
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError: # windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
+
+def serve(settings: dict, conn):
+    """Server process of a scenario: runs the image servers and the fake reddit, sends the fake reddit's
+    url over conn, and once anything is received back, stops them and sends the API call counts."""
+    from fake_reddit import FakeReddit
+    from image_server import ImageServer
+
+    images = [ImageServer(settings['image_size'], settings['image_latency'], settings['error_rate'], seed=i)
+              for i in range(settings['image_hosts'])]
+    reddit = FakeReddit([server.start() for server in images], settings['posts'], settings['image_ratio'],
+                        settings['api_latency'])
+    conn.send(reddit.start())
+    conn.recv()
+    for server in images:
+        server.stop()
+    reddit.stop()
+    conn.send(reddit.calls)
+
+def run_scenario(name: str) -> dict:
+    """Runs one scenario in this process, against servers in another, and returns its measurements."""
+    settings = dict(DEFAULTS, **SCENARIOS[name])
+    conn, server_conn = multiprocessing.Pipe()
+    server = multiprocessing.Process(target=serve, args=(settings, server_conn), daemon=True)
+    server.start()
+    api_url = conn.recv()
+
+    from redditScraper.redditScraper import redditScraper
+    from redditScraper.downloadJob import DownloadJob
+    from redditScraper.metrics import Metrics
+    from redditScraper.scheduler import JobQueue, REDDIT_API_BUDGET
+
+    # measure the scraper, not reddit's request budget
+    REDDIT_API_BUDGET.rate = REDDIT_API_BUDGET.capacity = 1000
+
+    scraper = redditScraper({'client_id': 'benchmark', 'client_secret': 'benchmark', 'user_agent': 'benchmark',
+                             'oauth_url': api_url, 'reddit_url': api_url})
+    first_image = []
+
+    def on_event(event):
+        if not first_image and event.get('stage') == 'download' and 'bytes' in event:
+            first_image.append(time.perf_counter())
+
+    metrics = Metrics([on_event])
+    outcomes = collections.Counter()
+    with tempfile.TemporaryDirectory() as output:
+        start = time.perf_counter()
+        with JobQueue(scraper, output, settings['workers'], settings['concurrent_jobs'], report=lambda m: None,
+                      metrics=metrics) as queue:
+            futures = [queue.add(DownloadJob('bench{}'.format(i), settings['num'], settings['num'] * 3,
+                                             settings['sorting'], near_duplicate_distance=-1))
+                       for i in range(settings['subreddits'])]
+        elapsed = time.perf_counter() - start
+        for future in futures:
+            outcomes.update(future.result())
+    conn.send('stop')
+    calls = conn.recv()
+    server.join()
+
+    counters = metrics.snapshot()['counters']
+    return {'scenario': name, 'settings': settings, 'seconds': elapsed,
+            'images': outcomes['downloaded'], 'failed': outcomes['failed'],
+            'images_per_sec': outcomes['downloaded'] / elapsed,
+            'time_to_first_image': first_image[0] - start if first_image else None,
+            'peak_rss_mb': peak_rss_mb(),
+            'api_calls': sum(calls.values()), 'listing_calls': calls['listing'],
+            'posts_scanned': counters.get('posts_scanned', 0), 'bytes': counters.get('bytes', 0),
+            'retries': counters.get('retries', 0)}
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCHMARK_FOLDER,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def compare(results: dict, previous: dict):
+    for name, result in results.items():
+        before = previous.get('scenarios', {}).get(name)
+        if before is None:
+            continue
+        changes = []
+        for key in COMPARED:
+            if result.get(key) and before.get(key):
+                change = result[key] / before[key] - 1
+                worse = change < 0 if key == 'images_per_sec' else change > 0
+                flag = '  <-- regression' if worse and abs(change) > 0.1 else ''
+                changes.append('{} {:+.0%}{}'.format(key, change, flag))
+        print('  {:<16} {}'.format(name, ', '.join(changes)))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('scenarios', nargs='*', help='scenarios to run (default all)')
+    parser.add_argument('--list', action='store_true', help='list the scenarios')
+    parser.add_argument('--no-save', action='store_true', help="don't save the results")
+    parser.add_argument('--compare', default=None, help='results file to compare with (default the latest saved)')
+    parser.add_argument('--child', default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        print(json.dumps(run_scenario(args.child)))
+        return 0
+    if args.list:
+        for name, settings in SCENARIOS.items():
+            print('{:<16} {}'.format(name, settings or 'defaults: {}'.format(DEFAULTS)))
+        return 0
+
+    names = args.scenarios or list(SCENARIOS)
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        parser.error('unknown scenarios: ' + ', '.join(unknown))
+
+    results = {}
+    print('{:<16} {:>8} {:>10} {:>10} {:>9} {:>6}'.format('scenario', 'images', 'images/s', 'first (s)', 'RSS (MB)', 'API'))
+    for name in names:
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', name],
+                                stdout=subprocess.PIPE, check=True).stdout
+        result = json.loads(output.decode().strip().splitlines()[-1])
+        results[name] = result
+        print('{:<16} {:>8} {:>10.1f} {:>10} {:>9} {:>6}'.format(
+            name, result['images'], result['images_per_sec'],
+            '{:.3f}'.format(result['time_to_first_image']) if result['time_to_first_image'] is not None else '-',
+            '{:.0f}'.format(result['peak_rss_mb']) if result['peak_rss_mb'] is not None else '-',
+            result['api_calls']))
+
+    previous_files = sorted(glob.glob(os.path.join(RESULTS_FOLDER, '*.json')))
+    previous_path = args.compare or (previous_files[-1] if previous_files else None)
+    if previous_path:
+        with open(previous_path) as f:
+            print('Compared with {}:'.format(os.path.basename(previous_path)))
+            compare(results, json.load(f))
+
+    if not args.no_save:
+        os.makedirs(RESULTS_FOLDER, exist_ok=True)
+        revision = git_revision()
+        path = os.path.join(RESULTS_FOLDER, '{}-{}.json'.format(
+            datetime.datetime.now().strftime('%Y-%m-%d-%H%M%S'), revision))
+        with open(path, 'w') as f:
+            json.dump({'revision': revision, 'python': sys.version.split()[0], 'scenarios': results}, f, indent=2)
+        print('Saved to {}'.format(path))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
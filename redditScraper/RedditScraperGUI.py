@@ -1,19 +1,38 @@
 import os
 from sys import exit
-from PyQt5.QtCore import QItemSelection, Qt, pyqtSlot, QModelIndex
-from .redditScraper import redditScraper
-from .downloadThread import RedditDownloadThread
+from PyQt5.QtCore import QItemSelection, Qt, pyqtSlot, QModelIndex, QTimer, QSize
+from .redditScraper import redditScraper, SORTINGS
+from .downloadThread import RedditDownloadThread, DuplicateScanThread, ExportThread
+from .downloadJob import DownloadJob
+from .manifests import unfinished_manifests
+from .dimensions import ASPECT_RATIOS
+from .postProcess import PostProcessOptions
+from .export import export_format
+from .imageLoader import PixmapCache
+from .gallery import GalleryView, ThumbnailModel
+from .catalogView import CatalogPanel
+from .progress import ProgressTracker
+from .progressModel import ProgressModel
 import configparser
-from PyQt5.QtGui import QPalette, QPixmap, QIntValidator, QIcon
+from PyQt5.QtGui import QPalette, QPixmap, QIntValidator, QIcon, QTextCursor, QMovie
 from PyQt5.QtWidgets import (QCheckBox, QScrollArea, QVBoxLayout, QWidget, QGridLayout, QLabel,
                              QPushButton,QAction,
                              QLineEdit, QMessageBox,
-                             QFileDialog, QTextEdit,
+                             QFileDialog, QPlainTextEdit,
                              QFileSystemModel, QTreeView,
                              QHBoxLayout, QMenuBar,
-                             QComboBox, QSizePolicy)
+                             QComboBox, QSizePolicy, QTabWidget)
 MAX_IMAGE_HEIGHT = 1200
 LOOKUP_LIMIT_MULTIPLIER = 3
+DOWNLOAD_WORKERS = 8
+CONCURRENT_JOBS = 4
+NEAR_DUPLICATE_DISTANCE = 6
+PREFETCH_IMAGES = 3
+IMAGE_EXTENSIONS = ["jpg","gif","png","jpeg","webp"]
+CACHE_FILE = 'redditScraper.cache.db'
+PROGRESS_INTERVAL_MS = 100 # how often the log and the progress tree are brought up to date
+LOG_LINES = 5000
+CONVERT_FORMATS = {'Keep as is': None, 'WebP': 'webp', 'AVIF': 'avif'}
 
 class RedditScraperWindow(QWidget):
     """The main window of the program."""
@@ -69,17 +88,47 @@ class RedditScraperWindow(QWidget):
         numLabel = QLabel('number of images')
         self.dirLabel = QLabel('choose a directory')
         scale_label = QLabel("Scale images?")
+        incremental_label = QLabel("Only new posts?")
+        min_size_label = QLabel('min. width x height')
+        aspect_label = QLabel('aspect ratio')
+        convert_label = QLabel('re-encode as')
         self.imgView = QLabel()
+        self.pixmap_cache = PixmapCache(parent=self)
+        self.current_image = None
+        self.movie = None
+        self.download_threads = []
+        self.export_thread = None
 
-        self.outputText = QTextEdit('')
+        self.outputText = QPlainTextEdit()
         self.outputText.setReadOnly(True)
+        self.outputText.setMaximumBlockCount(LOG_LINES)
+        # the download threads write to the tracker at any rate, the window picks it up every PROGRESS_INTERVAL_MS
+        self.progress = ProgressTracker()
+        self.progressModel = ProgressModel(self)
+        self.progressView = QTreeView()
+        self.progressView.setModel(self.progressModel)
+        self.progressView.setUniformRowHeights(True)
+        self.progressTimer = QTimer(self)
+        self.progressTimer.setInterval(PROGRESS_INTERVAL_MS)
         
         self.scale_cb = QCheckBox()
+        self.incremental_cb = QCheckBox()
+        self.incremental_cb.setToolTip('Only look at posts made since the last download of this subreddit and sorting')
+        # images smaller than this, or of another shape, are skipped, mostly without downloading them
+        self.minWidthInput = QLineEdit()
+        self.minWidthInput.setValidator(self.onlyInt)
+        self.minWidthInput.setPlaceholderText('any')
+        self.minHeightInput = QLineEdit()
+        self.minHeightInput.setValidator(self.onlyInt)
+        self.minHeightInput.setPlaceholderText('any')
+        self.aspectCb = QComboBox()
+        self.aspectCb.addItems(ASPECT_RATIOS)
+        self.convertCb = QComboBox()
+        self.convertCb.addItems(CONVERT_FORMATS)
+        self.convertCb.setToolTip('Re-encode downloaded images to save space; see the [DOWNLOAD] settings for more')
 
         self.sortingCb = QComboBox()
-        self.sortingCb.addItems(["Hot", "Top all time",
-                                 "Top this month", "Top past year",
-                                 "New", "Controversial"])
+        self.sortingCb.addItems(SORTINGS)
         sortingLabel = QLabel('sorting method')
         self.runButton = QPushButton('Download')
         self.runButton.setIcon(self.download_icon)
@@ -95,6 +144,17 @@ class RedditScraperWindow(QWidget):
         self.tree.setColumnHidden(2, True)
         self.tree.setColumnHidden(3, True)
 
+        self.galleryModel = ThumbnailModel(self)
+        self.gallery = GalleryView()
+        self.gallery.setModel(self.galleryModel)
+
+        self.browserTabs = QTabWidget()
+        self.browserTabs.addTab(self.tree, 'Files')
+        self.browserTabs.addTab(self.gallery, 'Gallery')
+        self.catalogPanel = CatalogPanel()
+        self.browserTabs.addTab(self.catalogPanel, 'Catalog')
+        self.browserTabs.addTab(self.progressView, 'Downloads')
+
 
         ############## Menu stuff ###################
         menu_bar = QMenuBar()
@@ -102,7 +162,15 @@ class RedditScraperWindow(QWidget):
         help_menu = menu_bar.addMenu('Help')
 
         self.exit_action = QAction('Exit', self)
-
+        self.scan_duplicates_action = QAction('Find near-duplicates', self)
+        self.download_all_action = QAction('Download all saved subreddits', self)
+        self.resume_action = QAction('Resume stopped downloads', self)
+        self.export_action = QAction('Export post metadata', self)
+
+        file_menu.addAction(self.download_all_action)
+        file_menu.addAction(self.resume_action)
+        file_menu.addAction(self.export_action)
+        file_menu.addAction(self.scan_duplicates_action)
         file_menu.addAction(self.exit_action)
         self.help_action = QAction('Help', self)
         help_menu.addAction(self.help_action)
@@ -124,14 +192,26 @@ class RedditScraperWindow(QWidget):
         grid.addWidget(self.dirLabel,4,1)
         grid.addWidget(self.stopButton,5,0)
         grid.addWidget(self.runButton,5,1)
-        grid.addWidget(self.outputText,7,0,7,2)
+        grid.addWidget(self.outputText,20,0,7,2)
         # grid.addWidget(self.tree,1,2, 11,7)
 
         grid.addWidget(scale_label, 6,0)
         grid.addWidget(self.scale_cb, 6, 1)
+        grid.addWidget(incremental_label, 7, 0)
+        grid.addWidget(self.incremental_cb, 7, 1)
+        min_size_box = QHBoxLayout()
+        min_size_box.addWidget(self.minWidthInput)
+        min_size_box.addWidget(QLabel('x'))
+        min_size_box.addWidget(self.minHeightInput)
+        grid.addWidget(min_size_label, 8, 0)
+        grid.addLayout(min_size_box, 8, 1)
+        grid.addWidget(aspect_label, 9, 0)
+        grid.addWidget(self.aspectCb, 9, 1)
+        grid.addWidget(convert_label, 10, 0)
+        grid.addWidget(self.convertCb, 10, 1)
 
         hboxTree = QVBoxLayout()
-        hboxTree.addWidget(self.tree)
+        hboxTree.addWidget(self.browserTabs)
 
 
         #the image viewer, setting how it behaves under resizing.
@@ -171,19 +251,31 @@ class RedditScraperWindow(QWidget):
         self.tree.clicked.connect(self.on_treeView_clicked)
         self.stopButton.clicked.connect(self.stop_download)
         self.scale_cb.clicked.connect(self.refresh_image)
+        self.pixmap_cache.loaded.connect(self.on_image_loaded)
         self.exit_action.triggered.connect(exit)
+        self.scan_duplicates_action.triggered.connect(self.scan_duplicates)
+        self.download_all_action.triggered.connect(self.download_all)
+        self.resume_action.triggered.connect(self.resume_downloads)
+        self.export_action.triggered.connect(self.export_metadata)
+        self.progressTimer.timeout.connect(self.drain_progress)
+        self.progressTimer.start()
 
         #self.edit_login_action.triggered.connect(self.edit_login_info)
         self.help_action.triggered.connect(self.show_help)
 
         self.tree.selectionModel().selectionChanged.connect(self.on_selection_change)
+        self.gallery.selectionModel().currentChanged.connect(self.on_gallery_current_change)
+        self.catalogPanel.imageSelected.connect(self.show_file)
 
     def read_user_config(self):
         """reads in the users username and password from the config file, or if there is no config file,
         shows an input dialog.
         Also tests so that only valid login information gets saved to the config file. """
         config = configparser.ConfigParser()
-        self.redditScraper = redditScraper()
+        self.redditScraper = redditScraper(cache_path=CACHE_FILE)
+        if not self.redditScraper.has_credentials():
+            print("You need to setup the reddit_secrets.py file with your reddit information!")
+            exit(1)
         if os.path.exists('redditScraper.ini'):
             config.read('redditScraper.ini')
 
@@ -211,6 +303,7 @@ class RedditScraperWindow(QWidget):
             idx = self.fileModel.setRootPath(str(self.folder))
             self.tree.setRootIndex(idx)
             self.dirLabel.setText(self.folder)
+            self.catalogPanel.set_base_folder(self.folder)
 
         if 'REDDIT' in self.config:
             self.subredditInput.setCurrentText(self.config['REDDIT']['subreddit'])
@@ -223,31 +316,93 @@ class RedditScraperWindow(QWidget):
     ################### Actions: ##################
     @pyqtSlot(QModelIndex)
     def on_treeView_clicked(self, index):
-        """triggers when the user clicks on a file item shown in the treeView, and shows that file in the picture viewer."""
+        """triggers when the user clicks on a file item shown in the treeView, and shows that file in the picture viewer.
+        Clicking a folder shows its images in the gallery tab."""
         index = self.fileModel.index(index.row(),0,index.parent() )
+        if self.fileModel.isDir(index) and hasattr(self, "folder"):
+            self.galleryModel.set_folder(self.fileModel.filePath(index), self.folder)
         self.show_image(index)
 
     def on_selection_change(self, selected: QItemSelection, deselected: QItemSelection):
         """ Triggers when the selected item in the treeview changes, and updates the shown picture. """
         self.refresh_image()
 
+    def on_gallery_current_change(self, current: QModelIndex, previous: QModelIndex):
+        """Shows the image picked in the gallery, prefetching the ones around it."""
+        if current.isValid():
+            paths = self.galleryModel.paths
+            self.show_file(paths[current.row()],
+                           [paths[row] for row in self.neighbour_rows(current.row()) if 0 <= row < len(paths)])
+
     def refresh_image(self):
-        selected_image_index = self.tree.selectedIndexes()[0]
-        self.show_image(selected_image_index)
+        if self.tree.selectedIndexes():
+            self.show_image(self.tree.selectedIndexes()[0])
+        elif self.current_image:
+            self.show_file(self.current_image)
+
+    def image_height(self):
+        """The height images are scaled to, or None when they are shown at full size."""
+        return MAX_IMAGE_HEIGHT if self.scale_cb.isChecked() else None
+
+    def neighbour_rows(self, row: int) -> list:
+        """Rows to prefetch around row, nearest first."""
+        return [r for offset in range(1, PREFETCH_IMAGES + 1) for r in (row + offset, row - offset)]
 
     def show_image(self, index: QModelIndex):
         filePath = self.fileModel.filePath(index)
-        if os.path.isfile(filePath) and filePath.split(".")[-1] in ["jpg","gif","png","jpeg"]:
-            pixmap=QPixmap(filePath)
-            if self.scale_cb.isChecked():
-                self.imgView.setFixedHeight(MAX_IMAGE_HEIGHT)
-                scaled_img = pixmap.scaledToHeight(MAX_IMAGE_HEIGHT)
-                self.imgView.setFixedWidth(scaled_img.width())
-                self.imgView.setPixmap(scaled_img)
-            else:
-                self.imgView.setFixedHeight(pixmap.height())
-                self.imgView.setFixedWidth(pixmap.width())
-                self.imgView.setPixmap(pixmap)
+        neighbours = [self.fileModel.filePath(index.sibling(row, 0)) for row in self.neighbour_rows(index.row())]
+        self.show_file(filePath, neighbours)
+
+    def show_file(self, filePath: str, neighbours: list = ()):
+        """Shows the image at filePath, from the pixmap cache if possible, otherwise once it has been decoded
+        in the background. Animated images are played instead, see play_movie.
+        The neighbouring files are prefetched so that stepping through a folder is instant."""
+        if os.path.isfile(filePath) and filePath.split(".")[-1] in IMAGE_EXTENSIONS:
+            self.current_image = filePath
+            cached = self.pixmap_cache.get(filePath, self.image_height())
+            if cached is not None:
+                self.display(filePath, *cached)
+            for neighbour in neighbours:
+                if neighbour and neighbour.split(".")[-1] in IMAGE_EXTENSIONS:
+                    self.pixmap_cache.prefetch(neighbour, self.image_height())
+
+    def on_image_loaded(self, filePath: str, scale_height, pixmap: QPixmap, animated: bool):
+        """Shows a pixmap decoded in the background, if it is the one currently wanted."""
+        if filePath == self.current_image and scale_height == self.image_height():
+            self.display(filePath, pixmap, animated)
+
+    def display(self, filePath: str, pixmap: QPixmap, animated: bool):
+        if animated:
+            self.play_movie(filePath, pixmap.size())
+        else:
+            self.set_image(pixmap)
+
+    def set_image(self, pixmap: QPixmap):
+        self.stop_movie()
+        self.imgView.setFixedHeight(pixmap.height())
+        self.imgView.setFixedWidth(pixmap.width())
+        self.imgView.setPixmap(pixmap)
+
+    def play_movie(self, filePath: str, size: QSize):
+        """Plays an animated image at size, that of its first frame as decoded by the pixmap cache.
+        QMovie reads and decodes one frame at a time from the file, at that size, and keeps no frames
+        around, so long GIFs cost no more memory than one frame."""
+        self.stop_movie()
+        movie = QMovie(filePath, parent=self)
+        movie.setCacheMode(QMovie.CacheNone)
+        if self.image_height():
+            movie.setScaledSize(size)
+        self.imgView.setFixedSize(size)
+        self.imgView.setMovie(movie)
+        self.movie = movie
+        movie.start()
+
+    def stop_movie(self):
+        if self.movie is not None:
+            self.imgView.clear()
+            self.movie.stop()
+            self.movie.deleteLater()
+            self.movie = None
 
     def show_dir_dialog(self):
         """lets the user select the root folder, and saves the choice to the config file."""
@@ -261,6 +416,7 @@ class RedditScraperWindow(QWidget):
 
         idx = self.fileModel.setRootPath(self.folder)
         self.tree.setRootIndex(idx)
+        self.catalogPanel.set_base_folder(self.folder)
 
 
         return self.folder
@@ -268,8 +424,18 @@ class RedditScraperWindow(QWidget):
 
     @pyqtSlot(str)
     def update_output_text(self, message:str):
-        """updates the output text area, to show progress on downloads."""
-        self.outputText.setText(message+self.outputText.toPlainText() )
+        """adds a message to the output text area; it is shown with the next drain_progress."""
+        self.progress.report(message)
+
+    def drain_progress(self):
+        """Appends everything logged since the last call to the output text area in one go,
+        and applies the coalesced job and image updates to the Downloads tab."""
+        text, changes = self.progress.drain()
+        if text:
+            self.outputText.moveCursor(QTextCursor.End)
+            self.outputText.insertPlainText(text)
+        if changes:
+            self.progressModel.apply(changes)
 
     def save_subreddit(self, subreddit: str, num: int, sorting: str):
         """helper function to save the current settings to the config file."""
@@ -296,6 +462,53 @@ class RedditScraperWindow(QWidget):
             return subreddits     
         return []
 
+    def new_job(self, subreddit: str, num: int, sorting: str) -> DownloadJob:
+        min_aspect, max_aspect = ASPECT_RATIOS[self.aspectCb.currentText()]
+        return DownloadJob(subreddit, num, num*LOOKUP_LIMIT_MULTIPLIER, sorting,
+                           self.config.getint('DOWNLOAD', 'max_bytes', fallback=None),
+                           self.config.getint('DOWNLOAD', 'near_duplicate_distance',
+                                              fallback=NEAR_DUPLICATE_DISTANCE),
+                           self.incremental_cb.isChecked(),
+                           int(self.minWidthInput.text() or 0), int(self.minHeightInput.text() or 0),
+                           min_aspect, max_aspect)
+
+    def queue_jobs(self, jobs: list):
+        """Adds the jobs to the running download thread if there is one for the current folder,
+        otherwise starts a new download thread for them."""
+        self.download_threads = [t for t in self.download_threads if t.isRunning()]
+        current = self.download_threads[-1] if self.download_threads else None
+        if current is not None and current.base_folder == self.folder:
+            jobs = [job for job in jobs if not current.add_job(job)]
+        if not jobs:
+            return
+        thread = RedditDownloadThread(self.redditScraper, jobs, self.folder,
+                                      self.config.getint('DOWNLOAD', 'workers', fallback=DOWNLOAD_WORKERS),
+                                      self.config.getint('DOWNLOAD', 'concurrent_jobs', fallback=CONCURRENT_JOBS),
+                                      self.config.get('DOWNLOAD', 'metrics_file', fallback=None),
+                                      self.config.get('DOWNLOAD', 'profile_file', fallback=None),
+                                      self.progress, self.post_process_options())
+        thread.finished.connect(self.catalogPanel.refresh)
+        self.download_threads.append(thread)
+        thread.start()
+
+    def post_process_options(self) -> PostProcessOptions:
+        """What to do with downloaded images: the format picked in the window,
+        and quality, max_width, max_height and strip_metadata from the [DOWNLOAD] settings."""
+        return PostProcessOptions(CONVERT_FORMATS[self.convertCb.currentText()],
+                                  self.config.getint('DOWNLOAD', 'quality', fallback=80),
+                                  self.config.getint('DOWNLOAD', 'max_width', fallback=None),
+                                  self.config.getint('DOWNLOAD', 'max_height', fallback=None),
+                                  self.config.getboolean('DOWNLOAD', 'strip_metadata', fallback=False))
+
+    def check_folder(self) -> bool:
+        if not hasattr(self, "folder"):
+            msgBox = QMessageBox()
+            msgBox.setText('You need to set a download folder!')
+            msgBox.setWindowTitle("Pick a download folder")
+            msgBox.exec_()
+            return False
+        return True
+
     def run_download_threaded(self):
         """downloads the pictures. Runs in a QThread, so that the program does not freeze.
         Also checks whether the specified subreddit exists. """
@@ -305,40 +518,88 @@ class RedditScraperWindow(QWidget):
 
         if self.redditScraper.sub_exists(subreddit):
 
-            if not hasattr(self, "folder"):
-                msgBox = QMessageBox()
-                msgBox.setText('You need to set a download folder!')
-                msgBox.setWindowTitle("Pick a download folder")
-                msgBox.exec_()
+            if not self.check_folder():
                 return
 
-
             self.save_subreddit(subreddit,num,sorting)
-            self.get_thread = RedditDownloadThread(self.redditScraper, subreddit, num,
-                                                    num*LOOKUP_LIMIT_MULTIPLIER,
-                                                   sorting, self.folder)
-            self.get_thread.changeText.connect(self.update_output_text)
-            self.get_thread.start()
+            self.queue_jobs([self.new_job(subreddit, num, sorting)])
         else:
             msgBox = QMessageBox()
             msgBox.setText('That subreddit does not exist, please try again')
             msgBox.setWindowTitle("Invalid subreddit")
             msgBox.exec_()
 
-
-        pass
+    def download_all(self):
+        """Queues a download of every saved subreddit, with the current number and sorting settings."""
+        if not self.check_folder():
+            return
+        num = int(self.numInput.text())
+        sorting = self.sortingCb.currentText()
+        self.queue_jobs([self.new_job(subreddit, num, sorting)
+                         for subreddit in self.get_downloaded_subreddits() if subreddit])
+
+    def resume_downloads(self):
+        """Queues every stopped or crashed download into the current folder, continuing from its manifest."""
+        if not self.check_folder():
+            return
+        running = {job.manifest_path for thread in self.download_threads if thread.isRunning() for job in thread.jobs}
+        jobs = [DownloadJob.from_manifest(path) for path in unfinished_manifests(self.folder) if path not in running]
+        if not jobs:
+            self.progress.report('There are no stopped downloads to resume in {}.\n'.format(self.folder))
+            return
+        self.queue_jobs(jobs)
 
     def stop_download(self):
-        """Stops the download thread and prints a message to the output."""
-        try:
-            if self.get_thread.isRunning():
-                self.get_thread.terminate()
-                self.outputText.setText(self.outputText.toPlainText() + ' Aborted!\n')
-        except Exception:
-            pass
+        """Stops the download threads: nothing new is started, and the downloads in progress are finished
+        before the threads end. The stopped jobs can be resumed from the File menu."""
+        for thread in self.download_threads:
+            if thread.isRunning() and not thread.stopping:
+                thread.stop()
+                self.progress.report('Stopping, waiting for the downloads in progress ...\n')
+        if self.export_thread is not None and self.export_thread.isRunning():
+            self.export_thread.stop()
 
     ############### Menu actions: ###############
-    
+
+    def scan_duplicates(self):
+        """Lets the user pick a folder under the base folder, and lists the near-duplicate images in it."""
+        if not hasattr(self, "folder"):
+            return
+        folder = QFileDialog.getExistingDirectory(self, 'Folder to scan for near-duplicates', self.folder)
+        if not folder:
+            return
+        self.scan_thread = DuplicateScanThread(self.folder, folder,
+                                               self.config.getint('DOWNLOAD', 'near_duplicate_distance',
+                                                                  fallback=NEAR_DUPLICATE_DISTANCE))
+        self.scan_thread.changeText.connect(self.update_output_text)
+        self.scan_thread.start()
+
+    def export_metadata(self):
+        """Exports the metadata of the posts the current subreddit, number and sorting settings look at
+        to a JSONL, CSV or Parquet file, with the local paths of the images already downloaded.
+        Doesn't download anything; Stop stops it."""
+        if not self.check_folder():
+            return
+        if self.export_thread is not None and self.export_thread.isRunning():
+            self.progress.report('An export is already running.\n')
+            return
+        subreddit = self.subredditInput.currentText()
+        num = int(self.numInput.text())
+        sorting = self.sortingCb.currentText()
+        path, _ = QFileDialog.getSaveFileName(self, 'Export post metadata',
+                                              os.path.join(self.folder, subreddit + '.jsonl'),
+                                              'JSON lines (*.jsonl);;CSV (*.csv);;Parquet (*.parquet)')
+        if not path:
+            return
+        try:
+            export_format(path)
+        except ValueError as e:
+            self.progress.report('Could not export: {}.\n'.format(e))
+            return
+        self.export_thread = ExportThread(self.redditScraper, path, [subreddit], sorting,
+                                          num * LOOKUP_LIMIT_MULTIPLIER, self.folder)
+        self.export_thread.changeText.connect(self.update_output_text)
+        self.export_thread.start()
 
     def show_help(self):
         msgBox = QMessageBox()
@@ -352,7 +613,8 @@ class RedditScraperWindow(QWidget):
                         +  "so links to gyf-files, videos or anything else will be ignored. Therefore the number of images actually "
                          +"downloaded will usually be less than the specified number. So if you want a lot of images, just put"
                        + " a large limit.\n The images will be placed in a subfolder of the chosen base folder, named after the subreddit. This folder will be created if it does not exist.\n \n "
-                        + "To view the images, click on them in the tree-view, and they will appear on the right" )
+                        + "To view the images, click on them in the tree-view, and they will appear on the right. "
+                        + "Clicking a folder shows thumbnails of its images in the Gallery tab." )
         msgBox.setWindowTitle("Help")
         msgBox.exec_()
 
@@ -0,0 +1,8 @@
+import time
+START = time.perf_counter()
+
+import sys
+from redditScraper.cli import main
+
+if __name__ == '__main__':
+    sys.exit(main(start=START))
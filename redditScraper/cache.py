@@ -0,0 +1,76 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+MISSING = object()
+
+class TTLCache:
+    """Thread-safe, size-bounded LRU cache whose entries expire after a per-entry time to live.
+    With a path, entries are also written through to a small SQLite file and read back from it
+    on a memory miss, so they survive restarts. Values must be picklable. Keys are strings.
+    Caches sharing a file keep their entries in different tables."""
+
+    def __init__(self, max_entries: int = 1024, path: str = None, table: str = 'cache'):
+        self.max_entries = max_entries
+        self.table = table
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if path is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute('CREATE TABLE IF NOT EXISTS {} (key TEXT PRIMARY KEY, expires REAL, value BLOB)'.format(table))
+            self._db.execute('DELETE FROM {} WHERE expires < ?'.format(table), (time.time(),))
+            self._db.commit()
+
+    def get(self, key: str, default=MISSING):
+        """Returns the cached value, or default if there is no fresh entry for key."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None and self._db is not None:
+                row = self._db.execute('SELECT expires, value FROM {} WHERE key = ?'.format(self.table), (key,)).fetchone()
+                if row is not None:
+                    entry = (row[0], pickle.loads(row[1]))
+                    self._store(key, entry)
+            if entry is None or entry[0] < now:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key: str, value, ttl: float):
+        entry = (time.time() + ttl, value)
+        with self._lock:
+            self._store(key, entry)
+            if self._db is not None:
+                self._db.execute('INSERT OR REPLACE INTO {} VALUES (?, ?, ?)'.format(self.table),
+                                 (key, entry[0], pickle.dumps(value, pickle.HIGHEST_PROTOCOL)))
+                if len(self._entries) == self.max_entries:
+                    # bound the file too, dropping whatever expires first
+                    self._db.execute('DELETE FROM {0} WHERE key NOT IN '
+                                     '(SELECT key FROM {0} ORDER BY expires DESC LIMIT ?)'.format(self.table),
+                                     (self.max_entries,))
+                self._db.commit()
+
+    def _store(self, key: str, entry: tuple):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._entries)}
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
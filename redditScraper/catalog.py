@@ -0,0 +1,166 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+from .storage import state_folder
+
+BATCH_SIZE = 500 # rows buffered before they are written in one transaction
+FLUSH_INTERVAL = 2.0 # seconds after which buffered rows are written anyway
+# what the catalog can be sorted by, and the SQL for it
+SORT_ORDERS = {'Score': 'score DESC',
+               'Newest': 'created_utc DESC',
+               'Oldest': 'created_utc ASC',
+               'Comments': 'num_comments DESC',
+               'Largest': 'width * height DESC',
+               'Recently downloaded': 'downloaded_at DESC'}
+# the index that reads the images in each of the SORT_ORDERS, and the one that does so for a single subreddit
+ORDER_INDEXES = {'Score': 'images_score', 'Newest': 'images_created', 'Oldest': 'images_created',
+                 'Comments': 'images_comments', 'Largest': 'images_pixels', 'Recently downloaded': 'images_downloaded'}
+SUBREDDIT_ORDER_INDEXES = {'Score': 'images_subreddit_score', 'Newest': 'images_subreddit_created',
+                           'Oldest': 'images_subreddit_created'}
+# a filter that matches fewer rows than this is applied first, through its index, and only its rows are sorted;
+# otherwise the rows are read in order and filtered, which finds limit matches after a few times as many rows
+SELECTIVE_ROWS = 20000
+
+CatalogEntry = namedtuple('CatalogEntry', ['path', 'post_id', 'subreddit', 'title', 'author', 'score',
+                                           'num_comments', 'created_utc', 'url', 'width', 'height', 'downloaded_at'])
+
+class Catalog:
+    """Queryable record of every downloaded image and the post it came from, in catalog.db in the state folder.
+    Download workers add rows, which are buffered and written BATCH_SIZE at a time (or every FLUSH_INTERVAL);
+    there are indexes for every filter and sort order of query, so queries stay fast with hundreds of
+    thousands of images. Safe to share between threads."""
+
+    def __init__(self, base_folder: str):
+        self.path = os.path.join(state_folder(base_folder), 'catalog.db')
+        self._lock = threading.Lock()
+        self._pending = []
+        self._last_flush = time.monotonic()
+        self._db = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.executescript('''
+            CREATE TABLE IF NOT EXISTS images (
+                path TEXT PRIMARY KEY, post_id TEXT, subreddit TEXT COLLATE NOCASE, title TEXT, author TEXT,
+                score INTEGER, num_comments INTEGER, created_utc REAL, url TEXT,
+                width INTEGER, height INTEGER, downloaded_at REAL);
+            CREATE INDEX IF NOT EXISTS images_subreddit_score ON images(subreddit, score);
+            CREATE INDEX IF NOT EXISTS images_subreddit_created ON images(subreddit, created_utc);
+            CREATE INDEX IF NOT EXISTS images_score ON images(score);
+            CREATE INDEX IF NOT EXISTS images_created ON images(created_utc);
+            CREATE INDEX IF NOT EXISTS images_post_id ON images(post_id);
+            CREATE INDEX IF NOT EXISTS images_pixels ON images(width * height);
+            CREATE INDEX IF NOT EXISTS images_width ON images(width);
+            CREATE INDEX IF NOT EXISTS images_height ON images(height);
+            CREATE INDEX IF NOT EXISTS images_comments ON images(num_comments);
+            CREATE INDEX IF NOT EXISTS images_downloaded ON images(downloaded_at);
+        ''')
+        # a full text index of the titles, kept in sync by triggers, when SQLite has FTS5
+        try:
+            self._db.executescript('''
+                CREATE VIRTUAL TABLE IF NOT EXISTS titles USING fts5(title, content='images', content_rowid='rowid');
+                CREATE TRIGGER IF NOT EXISTS images_insert AFTER INSERT ON images BEGIN
+                    INSERT INTO titles(rowid, title) VALUES (new.rowid, new.title);
+                END;
+                CREATE TRIGGER IF NOT EXISTS images_delete AFTER DELETE ON images BEGIN
+                    INSERT INTO titles(titles, rowid, title) VALUES ('delete', old.rowid, old.title);
+                END;
+                CREATE TRIGGER IF NOT EXISTS images_update AFTER UPDATE OF title ON images BEGIN
+                    INSERT INTO titles(titles, rowid, title) VALUES ('delete', old.rowid, old.title);
+                    INSERT INTO titles(rowid, title) VALUES (new.rowid, new.title);
+                END;
+            ''')
+            self.full_text = True
+        except sqlite3.OperationalError:
+            self.full_text = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def add(self, path: str, post, url: str, width: int = None, height: int = None):
+        """Records an image saved at path, from the post record post."""
+        row = CatalogEntry(path, post.id, post.subreddit, post.title, post.author, post.score, post.num_comments,
+                           post.created_utc, url, width, height, time.time())
+        with self._lock:
+            self._pending.append(row)
+            if len(self._pending) >= BATCH_SIZE or time.monotonic() - self._last_flush > FLUSH_INTERVAL:
+                self._flush()
+
+    def _flush(self):
+        if self._pending:
+            with self._db:
+                # an upsert rather than INSERT OR REPLACE, whose implicit delete would not fire the trigger
+                self._db.executemany('INSERT INTO images VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) '
+                                     'ON CONFLICT(path) DO UPDATE SET post_id = excluded.post_id, '
+                                     'subreddit = excluded.subreddit, title = excluded.title, author = excluded.author, '
+                                     'score = excluded.score, num_comments = excluded.num_comments, '
+                                     'created_utc = excluded.created_utc, url = excluded.url, width = excluded.width, '
+                                     'height = excluded.height, downloaded_at = excluded.downloaded_at',
+                                     self._pending)
+            self._pending = []
+        self._last_flush = time.monotonic()
+
+    def move(self, old_path: str, new_path: str, width: int = None, height: int = None):
+        """Records that the image at old_path is now at new_path, with a new size if it was resized."""
+        with self._lock:
+            self._flush()
+            with self._db:
+                self._db.execute('UPDATE images SET path = ?, width = COALESCE(?, width), height = COALESCE(?, height) '
+                                 'WHERE path = ?', (new_path, width, height, old_path))
+
+    def subreddits(self) -> list:
+        with self._lock:
+            return [row[0] for row in self._db.execute('SELECT DISTINCT subreddit FROM images ORDER BY subreddit')]
+
+    def query(self, subreddit: str = None, since: float = None, min_score: int = None, min_width: int = None,
+              min_height: int = None, title: str = None, order: str = 'Score', limit: int = 1000) -> list:
+        """Returns up to limit CatalogEntries matching every filter given: subreddit, posted after since
+        (a unix time), score, size, and title containing the words of title (the text, without FTS5);
+        sorted by one of SORT_ORDERS. Which index the rows are read through is chosen here, see _plan,
+        since SQLite can't tell how many rows a range matches."""
+        if title and self.full_text:
+            title_condition = 'rowid IN (SELECT rowid FROM titles WHERE titles MATCH ?)'
+            title = ' '.join('"{}"'.format(word.replace('"', '""')) for word in title.split())
+        else:
+            title_condition, title = 'title LIKE ?', '%' + title + '%' if title else None
+        filters = [(index, condition, value) for index, condition, value in (
+            ('images_subreddit_created', 'subreddit = ?', subreddit), ('images_created', 'created_utc >= ?', since),
+            ('images_score', 'score >= ?', min_score), ('images_width', 'width >= ?', min_width),
+            ('images_height', 'height >= ?', min_height), (None, title_condition, title)) if value is not None]
+        with self._lock:
+            self._flush()
+            sql = 'SELECT * FROM images'
+            index = self._plan(filters, order, subreddit is not None)
+            if index is not None:
+                sql += ' INDEXED BY ' + index
+            if filters:
+                sql += ' WHERE ' + ' AND '.join(condition for _, condition, _ in filters)
+            sql += ' ORDER BY {} LIMIT ?'.format(SORT_ORDERS[order])
+            return [CatalogEntry(*row) for row in self._db.execute(sql, [value for _, _, value in filters] + [limit])]
+
+    def _plan(self, filters: list, order: str, by_subreddit: bool) -> str:
+        """The index to read the rows of a query through; the caller holds the lock. The subreddit's own
+        index when that is also in the order; otherwise that of the filter matching the fewest rows, if it
+        matches fewer than SELECTIVE_ROWS (counted through the index, up to that many); otherwise the
+        order's index. None, leaving it to SQLite, for a title search, which the full text index narrows down."""
+        if any(index is None for index, _, _ in filters):
+            return None
+        if by_subreddit and order in SUBREDDIT_ORDER_INDEXES:
+            return SUBREDDIT_ORDER_INDEXES[order]
+        best, fewest = ORDER_INDEXES[order], SELECTIVE_ROWS
+        for index, condition, value in filters:
+            count = self._db.execute('SELECT count(*) FROM (SELECT 1 FROM images INDEXED BY {} WHERE {} LIMIT ?)'.format(
+                index, condition), (value, SELECTIVE_ROWS)).fetchone()[0]
+            if count < fewest:
+                best, fewest = index, count
+        return best
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            self._db.close()
@@ -0,0 +1,148 @@
+import datetime
+import time
+from PyQt5.QtCore import QAbstractTableModel, QModelIndex, Qt, QTimer, pyqtSignal
+from PyQt5.QtGui import QIntValidator
+from PyQt5.QtWidgets import (QAbstractItemView, QComboBox, QGridLayout, QLabel, QLineEdit, QPushButton, QTableView,
+                             QVBoxLayout, QWidget)
+
+from .catalog import Catalog, SORT_ORDERS
+
+COLUMNS = ('Title', 'Subreddit', 'Score', 'Comments', 'Size', 'Posted')
+PERIODS = {'Any time': None, 'Past day': 86400, 'Past week': 7 * 86400, 'Past month': 30 * 86400,
+           'Past year': 365 * 86400}
+ALL_SUBREDDITS = 'All subreddits'
+QUERY_DELAY_MS = 200 # typing in a filter queries the catalog once the user pauses
+RESULT_LIMIT = 2000
+
+class CatalogModel(QAbstractTableModel):
+    """Table of CatalogEntries, as returned by Catalog.query."""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.entries = []
+
+    def set_entries(self, entries: list):
+        self.beginResetModel()
+        self.entries = entries
+        self.endResetModel()
+
+    def rowCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.entries)
+
+    def columnCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        return len(COLUMNS)
+
+    def headerData(self, section: int, orientation, role: int = Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return COLUMNS[section]
+        return None
+
+    def data(self, index: QModelIndex, role: int = Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        entry = self.entries[index.row()]
+        if role == Qt.DisplayRole:
+            size = '{}x{}'.format(entry.width, entry.height) if entry.width else ''
+            posted = datetime.date.fromtimestamp(entry.created_utc).isoformat() if entry.created_utc else ''
+            return (entry.title, entry.subreddit, entry.score, entry.num_comments, size, posted)[index.column()]
+        if role == Qt.ToolTipRole:
+            return '{}\nby {}\n{}'.format(entry.title, entry.author, entry.path)
+        return None
+
+class CatalogPanel(QWidget):
+    """Filter and sort panel over the catalog of the base folder; picking a row emits imageSelected
+    with the path of that image, and its neighbours in the table for prefetching."""
+
+    imageSelected = pyqtSignal(str, list)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.catalog = None
+
+        self.subredditCb = QComboBox()
+        self.subredditCb.addItem(ALL_SUBREDDITS)
+        self.periodCb = QComboBox()
+        self.periodCb.addItems(PERIODS)
+        self.minScoreInput = QLineEdit()
+        self.minScoreInput.setValidator(QIntValidator())
+        self.minScoreInput.setPlaceholderText('min. score')
+        self.titleInput = QLineEdit()
+        self.titleInput.setPlaceholderText('title contains')
+        self.sortCb = QComboBox()
+        self.sortCb.addItems(SORT_ORDERS)
+        self.refreshButton = QPushButton('Refresh')
+        self.countLabel = QLabel()
+
+        self.model = CatalogModel(self)
+        self.table = QTableView()
+        self.table.setModel(self.model)
+        self.table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.table.setSelectionMode(QAbstractItemView.SingleSelection)
+        self.table.verticalHeader().setVisible(False)
+        self.table.horizontalHeader().setStretchLastSection(True)
+
+        self.queryTimer = QTimer(self)
+        self.queryTimer.setSingleShot(True)
+        self.queryTimer.setInterval(QUERY_DELAY_MS)
+
+        grid = QGridLayout()
+        grid.addWidget(self.subredditCb, 0, 0)
+        grid.addWidget(self.periodCb, 0, 1)
+        grid.addWidget(self.minScoreInput, 1, 0)
+        grid.addWidget(self.sortCb, 1, 1)
+        grid.addWidget(self.titleInput, 2, 0, 1, 2)
+        grid.addWidget(self.countLabel, 3, 0)
+        grid.addWidget(self.refreshButton, 3, 1)
+        layout = QVBoxLayout()
+        layout.addLayout(grid)
+        layout.addWidget(self.table)
+        self.setLayout(layout)
+
+        for combo in (self.subredditCb, self.periodCb, self.sortCb):
+            combo.currentIndexChanged.connect(self.run_query)
+        self.minScoreInput.textChanged.connect(self.queryTimer.start)
+        self.titleInput.textChanged.connect(self.queryTimer.start)
+        self.queryTimer.timeout.connect(self.run_query)
+        self.refreshButton.clicked.connect(self.refresh)
+        self.table.selectionModel().currentRowChanged.connect(self.on_current_row_change)
+
+    def set_base_folder(self, base_folder: str):
+        if self.catalog is not None:
+            self.catalog.close()
+        self.catalog = Catalog(base_folder)
+        self.refresh()
+
+    def refresh(self):
+        """Reloads the subreddit choices and runs the query again, e.g. after downloading."""
+        if self.catalog is None:
+            return
+        current = self.subredditCb.currentText()
+        self.subredditCb.blockSignals(True)
+        self.subredditCb.clear()
+        self.subredditCb.addItem(ALL_SUBREDDITS)
+        self.subredditCb.addItems(self.catalog.subreddits())
+        self.subredditCb.setCurrentText(current)
+        self.subredditCb.blockSignals(False)
+        self.run_query()
+
+    def run_query(self):
+        if self.catalog is None:
+            return
+        period = PERIODS[self.periodCb.currentText()]
+        subreddit = self.subredditCb.currentText()
+        min_score = self.minScoreInput.text()
+        entries = self.catalog.query(subreddit=None if subreddit == ALL_SUBREDDITS else subreddit,
+                                     since=time.time() - period if period else None,
+                                     min_score=int(min_score) if min_score.lstrip('-').isdigit() else None,
+                                     title=self.titleInput.text().strip() or None,
+                                     order=self.sortCb.currentText(), limit=RESULT_LIMIT)
+        self.model.set_entries(entries)
+        self.countLabel.setText('{}{} images'.format(len(entries), '+' if len(entries) == RESULT_LIMIT else ''))
+
+    def on_current_row_change(self, current: QModelIndex, previous: QModelIndex):
+        if not current.isValid():
+            return
+        entries = self.model.entries
+        row = current.row()
+        neighbours = [entries[r].path for r in (row + 1, row - 1) if 0 <= r < len(entries)]
+        self.imageSelected.emit(entries[row].path, neighbours)
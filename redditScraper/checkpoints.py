@@ -0,0 +1,32 @@
+import os
+import sqlite3
+from contextlib import closing
+
+from .storage import state_folder
+
+class CheckpointStore:
+    """Remembers, per subreddit and sorting, the newest post an incremental run has processed.
+    Kept in checkpoints.db in the state folder; every call opens its own connection, so jobs
+    running in different threads can share one store."""
+
+    def __init__(self, base_folder: str):
+        self.path = os.path.join(state_folder(base_folder), 'checkpoints.db')
+        with closing(self._connect()) as db, db:
+            db.execute('''CREATE TABLE IF NOT EXISTS checkpoints (
+                              subreddit TEXT, sorting TEXT, fullname TEXT, created_utc REAL,
+                              PRIMARY KEY (subreddit, sorting))''')
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def get(self, sub: str, sorting: str) -> dict:
+        """Returns {'fullname': ..., 'created_utc': ...} of the newest processed post, or None before the first run."""
+        with closing(self._connect()) as db, db:
+            row = db.execute('SELECT fullname, created_utc FROM checkpoints WHERE subreddit = ? AND sorting = ?',
+                             (sub.lower(), sorting)).fetchone()
+        return {'fullname': row[0], 'created_utc': row[1]} if row else None
+
+    def set(self, sub: str, sorting: str, checkpoint: dict):
+        with closing(self._connect()) as db, db:
+            db.execute('INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?)',
+                       (sub.lower(), sorting, checkpoint['fullname'], checkpoint['created_utc']))
@@ -0,0 +1,123 @@
+"""Headless command line mode: python -m redditScraper SUBREDDIT [SUBREDDIT ...] -o FOLDER
+Never imports Qt, and only imports PRAW once the first request is about to be made."""
+import argparse
+import importlib.util
+import os
+import sys
+import time
+
+from .redditScraper import redditScraper, SORTINGS
+from .downloadJob import DownloadJob
+from .manifests import unfinished_manifests
+from .postProcess import PostProcessOptions, FORMATS
+from .export import export_listings, export_format, EXPORT_FORMATS
+from .credentials import load_credentials
+from .storage import state_folder
+from .metrics import Metrics, JsonlSink, profiled
+
+LOOKUP_LIMIT_MULTIPLIER = 3
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m redditScraper',
+                                     description='Downloads images posted to subreddits, without the GUI.')
+    parser.add_argument('subreddits', nargs='*', help='subreddits to download from')
+    parser.add_argument('-o', '--output', required=True,
+                        help='base folder, images are saved in a subfolder per subreddit')
+    parser.add_argument('-n', '--num', type=int, default=10, help='number of images per subreddit (default 10)')
+    parser.add_argument('-s', '--sorting', choices=SORTINGS, default='Hot', help='sorting method (default Hot)')
+    parser.add_argument('--limit', type=int, default=None,
+                        help='number of posts to look through (default {} times --num)'.format(LOOKUP_LIMIT_MULTIPLIER))
+    parser.add_argument('--incremental', action='store_true',
+                        help='only look at posts made since the last incremental run, e.g. when polling')
+    parser.add_argument('--resume', action='store_true',
+                        help='first continue the downloads into the output folder that were stopped (Ctrl+C) or crashed')
+    parser.add_argument('--credentials', default=None,
+                        help='ini file with a [REDDIT] section holding client_id, client_secret and user_agent. '
+                             'Otherwise the REDDIT_CLIENT_ID, REDDIT_CLIENT_SECRET and REDDIT_USER_AGENT '
+                             'environment variables, or reddit_secrets.py, are used')
+    parser.add_argument('--no-cache', action='store_true',
+                        help="don't keep fetched listing pages and subreddit checks on disk between runs")
+    parser.add_argument('--workers', type=int, default=8, help='concurrent image downloads (default 8)')
+    parser.add_argument('--concurrent-jobs', type=int, default=4, help='subreddits listed at the same time (default 4)')
+    parser.add_argument('--max-bytes', type=int, default=None, help='skip images larger than this')
+    parser.add_argument('--near-duplicate-distance', type=int, default=6,
+                        help='perceptual hash bits two images may differ by to count as duplicates, -1 to disable')
+    parser.add_argument('--min-width', type=int, default=0, help='skip images narrower than this many pixels')
+    parser.add_argument('--min-height', type=int, default=0, help='skip images lower than this many pixels')
+    parser.add_argument('--min-aspect', type=float, default=None,
+                        help='skip images whose width/height is below this, e.g. 1.77 for 16:9 and wider')
+    parser.add_argument('--max-aspect', type=float, default=None,
+                        help='skip images whose width/height is above this, e.g. 1 for portrait only')
+    parser.add_argument('--convert', choices=sorted(FORMATS), default=None,
+                        help='re-encode the downloaded images to this format (avif needs Pillow 11.2 or pillow-avif-plugin)')
+    parser.add_argument('--quality', type=int, default=80, help='quality for --convert (default 80)')
+    parser.add_argument('--max-width', type=int, default=None, help='shrink downloaded images wider than this')
+    parser.add_argument('--max-height', type=int, default=None, help='shrink downloaded images higher than this')
+    parser.add_argument('--strip-metadata', action='store_true',
+                        help='remove EXIF data and color profiles from the downloaded images')
+    parser.add_argument('--export', default=None,
+                        help='write the metadata of the --limit posts looked at per subreddit to this {} file, '
+                             'after downloading (parquet needs pyarrow)'.format('/'.join(EXPORT_FORMATS)))
+    parser.add_argument('--no-download', action='store_true', help='only --export, without downloading images')
+    parser.add_argument('--metrics', default=None, help='append structured timing and counter events to this JSONL file')
+    parser.add_argument('--profile', default=None, help='profile the run with cProfile and save the stats to this file')
+    parser.add_argument('--timing', action='store_true', help='print startup and run times')
+    args = parser.parse_args(argv)
+    if not args.subreddits and not args.resume:
+        parser.error('give at least one subreddit, or --resume')
+    if args.no_download and not args.export:
+        parser.error('--no-download needs --export')
+    if args.export:
+        try:
+            export_format(args.export)
+        except ValueError as e:
+            parser.error(str(e))
+        if export_format(args.export) == 'parquet' and importlib.util.find_spec('pyarrow') is None:
+            parser.error('exporting to Parquet needs pyarrow: pip install pyarrow')
+    return args
+
+def main(argv=None, start: float = None) -> int:
+    start = start if start is not None else time.perf_counter()
+    args = parse_args(argv)
+    credentials = load_credentials(args.credentials)
+    if credentials is None:
+        print('No reddit credentials found! Pass --credentials, set REDDIT_CLIENT_ID and REDDIT_CLIENT_SECRET, '
+              'or setup the reddit_secrets.py file.', file=sys.stderr)
+        return 1
+
+    cache_path = None if args.no_cache else os.path.join(state_folder(args.output), 'cache.db')
+    scraper = redditScraper(credentials, cache_path)
+    metrics = Metrics([JsonlSink(args.metrics)] if args.metrics else [])
+    limit = args.limit if args.limit is not None else args.num * LOOKUP_LIMIT_MULTIPLIER
+    jobs = [DownloadJob.from_manifest(path) for path in unfinished_manifests(args.output)] if args.resume else []
+    if args.resume and not jobs:
+        print('There are no stopped downloads to resume in {}.'.format(args.output))
+    jobs += [DownloadJob(sub, args.num, limit, args.sorting, max_bytes=args.max_bytes,
+                         near_duplicate_distance=args.near_duplicate_distance, incremental=args.incremental,
+                         min_width=args.min_width, min_height=args.min_height,
+                         min_aspect=args.min_aspect, max_aspect=args.max_aspect)
+             for sub in args.subreddits]
+    results = []
+    with profiled(args.profile):
+        if not args.no_download:
+            results = scraper.run_jobs(jobs, args.output, workers=args.workers, concurrent_jobs=args.concurrent_jobs,
+                                       post_process=PostProcessOptions(args.convert, args.quality, args.max_width,
+                                                                       args.max_height, args.strip_metadata),
+                                       metrics=metrics)
+        if args.export:
+            # the listing pages just fetched for downloading are still cached (unless --incremental
+            # only fetched the newest posts), so this costs no extra requests
+            try:
+                export_listings(scraper.with_metrics(metrics), args.export, args.subreddits, args.sorting, limit,
+                                args.output)
+            except KeyboardInterrupt:
+                print('Stopped, {} is incomplete.'.format(args.export))
+    metrics.close()
+    if args.timing:
+        from .scheduler import RateLimitedRequestor
+        if RateLimitedRequestor.first_request_at is not None:
+            print('Startup to first reddit request: {:.0f} ms'.format(
+                1000 * (RateLimitedRequestor.first_request_at - start)))
+        print('Total: {:.1f} s'.format(time.perf_counter() - start))
+        print('Cache: {hits} hits, {misses} misses'.format(**scraper.cache.stats()))
+    return 0 if all(result is not None for result in results) else 2
@@ -0,0 +1,37 @@
+import os
+import configparser
+
+# environment variables that override everything else, e.g. for cron jobs and containers
+ENV_VARS = {'client_id': 'REDDIT_CLIENT_ID',
+            'client_secret': 'REDDIT_CLIENT_SECRET',
+            'user_agent': 'REDDIT_USER_AGENT'}
+DEFAULT_USER_AGENT = 'image_scraper'
+# optional settings that point the client at another server, e.g. the benchmarks' fake reddit
+URL_ENV_VARS = {'oauth_url': 'REDDIT_OAUTH_URL',
+                'reddit_url': 'REDDIT_URL'}
+
+def load_credentials(path: str = None) -> dict:
+    """Finds the reddit app credentials, returns a dict with client_id, client_secret and user_agent,
+    or None if there are none. Looked up, in order, in:
+    the ini file at path (a [REDDIT] section), the REDDIT_* environment variables, and reddit_secrets.py.
+    oauth_url and reddit_url are included when set in the ini file or REDDIT_OAUTH_URL and REDDIT_URL."""
+    if path is not None:
+        config = configparser.ConfigParser()
+        if not config.read(path) or 'REDDIT' not in config:
+            return None
+        credentials = {key: config['REDDIT'].get(key, '') for key in list(ENV_VARS) + list(URL_ENV_VARS)}
+    elif os.environ.get(ENV_VARS['client_id']) and os.environ.get(ENV_VARS['client_secret']):
+        credentials = {key: os.environ.get(var, '') for key, var in ENV_VARS.items()}
+    else:
+        try:
+            import redditScraper.reddit_secrets as secrets
+        except ImportError:
+            return None
+        credentials = {key: getattr(secrets, key, '') for key in ENV_VARS}
+
+    if not credentials['client_id'] or not credentials['client_secret']:
+        return None
+    credentials['user_agent'] = credentials['user_agent'] or DEFAULT_USER_AGENT
+    for key, var in URL_ENV_VARS.items():
+        credentials[key] = credentials.get(key) or os.environ.get(var) or None
+    return credentials
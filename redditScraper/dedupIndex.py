@@ -0,0 +1,102 @@
+import os
+import sqlite3
+import threading
+from urllib.parse import urlsplit, urlunsplit
+
+from .storage import state_folder
+
+# hosts that serve the same image regardless of the query string (which only carries resizing/tracking options)
+STATIC_IMAGE_HOSTS = {'i.redd.it', 'i.imgur.com', 'preview.redd.it'}
+
+def normalize_url(url: str) -> str:
+    """Normalizes an image url so that trivially different links to the same file compare equal."""
+    parts = urlsplit(url.strip())
+    scheme = 'https' if parts.scheme in ('http', 'https') else parts.scheme
+    host = parts.netloc.lower()
+    query = '' if host in STATIC_IMAGE_HOSTS else parts.query
+    return urlunsplit((scheme, host, parts.path, query, ''))
+
+class DedupIndex:
+    """On-disk index of everything downloaded into a base folder, stored in SQLite.
+    Maps normalized source urls (and their post ids) to the SHA-256 of the content and the saved path,
+    and content hashes to the first file saved with that content. Lookups are primary-key B-tree searches,
+    so they stay fast with hundreds of thousands of entries. Safe to share between download workers."""
+
+    def __init__(self, base_folder: str):
+        self.path = os.path.join(state_folder(base_folder), 'index.db')
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.executescript('''
+            CREATE TABLE IF NOT EXISTS urls (
+                url TEXT PRIMARY KEY, post_id TEXT, sha256 TEXT, path TEXT) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS contents (
+                sha256 TEXT PRIMARY KEY, path TEXT) WITHOUT ROWID;
+        ''')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def lookup(self, url: str) -> str:
+        """Returns the saved path for url if it was downloaded before and the file is still there."""
+        with self._lock:
+            row = self._db.execute('SELECT path FROM urls WHERE url = ?', (normalize_url(url),)).fetchone()
+        if row and row[0] and os.path.exists(row[0]):
+            return row[0]
+        return None
+
+    def path_for_content(self, sha256: str) -> str:
+        """Returns the existing file with this content hash, if there is one."""
+        with self._lock:
+            row = self._db.execute('SELECT path FROM contents WHERE sha256 = ?', (sha256,)).fetchone()
+        if row and os.path.exists(row[0]):
+            return row[0]
+        return None
+
+    def add(self, url: str, post_id: str, sha256: str, path: str) -> str:
+        """Records a finished download. If identical bytes are already on disk under another name,
+        the new file is replaced by a hardlink to the existing one (or removed, where hardlinks are
+        not supported). Returns the path the content can be found at."""
+        existing = self.path_for_content(sha256)
+        if existing and os.path.abspath(existing) != os.path.abspath(path):
+            os.remove(path)
+            try:
+                os.link(existing, path)
+            except OSError:
+                path = existing
+        self.record(url, post_id, sha256, path, replace_content=existing is None)
+        return path
+
+    def record(self, url: str, post_id: str, sha256: str, path: str, replace_content: bool = False):
+        """Records that url (from post_id) is available at path, without touching any files.
+        With replace_content, path also becomes the file recorded for this content hash."""
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO urls VALUES (?, ?, ?, ?)',
+                             (normalize_url(url), post_id, sha256, path))
+            self._db.execute('INSERT OR IGNORE INTO contents VALUES (?, ?)', (sha256, path))
+            if replace_content:
+                # the file previously recorded for this content is gone, so point at the new one
+                self._db.execute('UPDATE contents SET path = ? WHERE sha256 = ?', (path, sha256))
+            self._db.commit()
+
+    def move(self, old_path: str, new_path: str, sha256: str = None):
+        """Records that the file at old_path is now at new_path. With sha256, its content changed too,
+        e.g. it was re-encoded: the old content hash no longer points at it, so that a later download
+        of the original bytes is not linked to a file that holds something else."""
+        with self._lock:
+            if sha256 is None:
+                self._db.execute('UPDATE urls SET path = ? WHERE path = ?', (new_path, old_path))
+                self._db.execute('UPDATE contents SET path = ? WHERE path = ?', (new_path, old_path))
+            else:
+                self._db.execute('UPDATE urls SET path = ?, sha256 = ? WHERE path = ?', (new_path, sha256, old_path))
+                self._db.execute('DELETE FROM contents WHERE path = ?', (old_path,))
+                self._db.execute('INSERT OR IGNORE INTO contents VALUES (?, ?)', (sha256, new_path))
+            self._db.commit()
@@ -0,0 +1,97 @@
+import struct
+
+# JPEG start-of-frame markers, which hold the image size; C4, C8 and CC are other markers in that range
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+# JPEG markers without a length field
+JPEG_STANDALONE_MARKERS = {0x01, 0xD0, 0xD1, 0xD2, 0xD3, 0xD4, 0xD5, 0xD6, 0xD7, 0xD8, 0xD9}
+# enough of a file for image_size; JPEGs with big EXIF blocks need the most
+HEADER_BYTES = 32 * 1024
+# aspect ratio choices of the GUI, as (min, max) width/height
+ASPECT_RATIOS = {'Any': (None, None),
+                 'Landscape': (1.0, None),
+                 'Portrait': (None, 1.0),
+                 'Widescreen (16:9 or wider)': (16 / 9, None),
+                 'Ultrawide (21:9 or wider)': (21 / 9, None)}
+
+def image_size(data: bytes) -> tuple:
+    """(width, height) of a JPEG, PNG, GIF or WebP image from the first bytes of the file,
+    or None if they are not enough, or not an image of those types."""
+    try:
+        if data[:3] == b'\xff\xd8\xff':
+            return _jpeg_size(data)
+        if data[:8] == b'\x89PNG\r\n\x1a\n' and data[12:16] == b'IHDR':
+            return struct.unpack('>II', data[16:24])
+        if data[:6] in (b'GIF87a', b'GIF89a'):
+            return struct.unpack('<HH', data[6:10])
+        if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+            return _webp_size(data)
+    except struct.error: # cut off in the middle of the header
+        return None
+    return None
+
+def read_image_size(path: str) -> tuple:
+    """(width, height) of the image file at path from its header, or None, see image_size."""
+    try:
+        with open(path, 'rb') as f:
+            return image_size(f.read(HEADER_BYTES))
+    except OSError:
+        return None
+
+def _jpeg_size(data: bytes) -> tuple:
+    i = 2
+    while i + 4 <= len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF: # fill byte
+            i += 1
+            continue
+        if marker in JPEG_STANDALONE_MARKERS:
+            i += 2
+            continue
+        if marker in JPEG_SOF_MARKERS:
+            height, width = struct.unpack('>HH', data[i + 5:i + 9])
+            return width, height
+        i += 2 + struct.unpack('>H', data[i + 2:i + 4])[0]
+    return None
+
+def _webp_size(data: bytes) -> tuple:
+    chunk = data[12:16]
+    if chunk == b'VP8 ':
+        width, height = struct.unpack('<HH', data[26:30])
+        return width & 0x3FFF, height & 0x3FFF
+    if chunk == b'VP8L':
+        bits = struct.unpack('<I', data[21:25])[0]
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk == b'VP8X':
+        return (int.from_bytes(data[24:27], 'little') + 1, int.from_bytes(data[27:30], 'little') + 1)
+    return None
+
+class SizeFilter:
+    """Minimum width and height, and a range of aspect ratios (width/height), that images must have.
+    Every limit is optional; a filter without any accepts everything and is false."""
+
+    def __init__(self, min_width: int = 0, min_height: int = 0, min_aspect: float = None, max_aspect: float = None):
+        self.min_width = min_width or 0
+        self.min_height = min_height or 0
+        self.min_aspect = min_aspect
+        self.max_aspect = max_aspect
+
+    def __bool__(self):
+        return bool(self.min_width or self.min_height or self.min_aspect or self.max_aspect)
+
+    def __str__(self):
+        limits = []
+        if self.min_width or self.min_height:
+            limits.append('at least {}x{}'.format(self.min_width, self.min_height))
+        if self.min_aspect:
+            limits.append('aspect >= {:.2f}'.format(self.min_aspect))
+        if self.max_aspect:
+            limits.append('aspect <= {:.2f}'.format(self.max_aspect))
+        return ', '.join(limits) or 'any size'
+
+    def accepts(self, width: int, height: int) -> bool:
+        if width < self.min_width or height < self.min_height or not height:
+            return False
+        aspect = width / height
+        return not ((self.min_aspect and aspect < self.min_aspect) or (self.max_aspect and aspect > self.max_aspect))
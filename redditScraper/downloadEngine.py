@@ -0,0 +1,107 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .metrics import Metrics
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+class DownloadEngine:
+    """Runs image downloads concurrently on a thread pool.
+    All workers share one requests.Session, so keep-alive connections are pooled and reused,
+    at most per_host requests are in flight to any one host, and 429/5xx responses are
+    retried with exponential backoff instead of sleeping a fixed time after every file."""
+
+    def __init__(self, workers: int = 8, per_host: int = 4, max_retries: int = 4,
+                 backoff: float = 0.5, max_backoff: float = 30.0, timeout: float = 16, metrics=None):
+        self.workers = workers
+        self.per_host = per_host
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.metrics = metrics if metrics is not None else Metrics()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=16, pool_maxsize=max(workers, per_host))
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._host_slots = {}
+        self._host_lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self, wait: bool = True):
+        self._executor.shutdown(wait=wait)
+        self.session.close()
+
+    def submit(self, fn, *args, **kwargs):
+        """Schedules fn(*args, **kwargs) on the worker pool, returns a Future."""
+        return self._executor.submit(fn, *args, **kwargs)
+
+    def _host_slot(self, host: str) -> threading.Semaphore:
+        with self._host_lock:
+            if host not in self._host_slots:
+                self._host_slots[host] = threading.BoundedSemaphore(self.per_host)
+            return self._host_slots[host]
+
+    def _retry_delay(self, attempt: int, response=None) -> float:
+        """How long to wait before the next attempt, honouring Retry-After when the server sends one."""
+        if response is not None and 'Retry-After' in response.headers:
+            value = response.headers['Retry-After']
+            try:
+                return min(float(value), self.max_backoff)
+            except ValueError:
+                try:
+                    return min(max(parsedate_to_datetime(value).timestamp() - time.time(), 0), self.max_backoff)
+                except (TypeError, ValueError):
+                    pass
+        delay = min(self.backoff * 2 ** attempt, self.max_backoff)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    @contextmanager
+    def open(self, url: str, **kwargs):
+        """Context manager yielding a streaming response for url.
+        The host slot is held until the block exits, so the body transfer counts towards the per-host cap."""
+        with self._host_slot(urlsplit(url).netloc):
+            response = self.get(url, stream=True, **kwargs)
+            try:
+                yield response
+            finally:
+                response.close()
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        """GET with backoff on 429/5xx and connection errors. The last response is returned
+        (or the last exception raised) once max_retries is exhausted."""
+        kwargs.setdefault('timeout', self.timeout)
+        host = urlsplit(url).netloc
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                self.metrics.count('retries', host=host)
+            try:
+                with self.metrics.timer('request', host=host) as fields:
+                    response = self.session.get(url, **kwargs)
+                    fields['status'] = response.status_code
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == self.max_retries:
+                    raise
+                time.sleep(self._retry_delay(attempt))
+                continue
+            if response.status_code not in RETRY_STATUSES or attempt == self.max_retries:
+                return response
+            delay = self._retry_delay(attempt, response)
+            response.close()
+            time.sleep(delay)
@@ -0,0 +1,229 @@
+import os
+import re
+import datetime
+import collections
+import threading
+from concurrent.futures import wait
+
+from .dedupIndex import DedupIndex
+from .checkpoints import CheckpointStore
+from .manifests import JobManifest, unfinished_manifests
+from .redditScraper import ImagePost
+from .dimensions import SizeFilter, read_image_size
+from .progress import ACTIVE, DONE, FAILED
+
+# the highest index handed out per (folder, filename prefix) in this process, see next_filename
+_filename_indexes = {}
+_filename_lock = threading.Lock()
+
+def next_filename(base_folder: str, folder: str, prefix: str) -> str:
+    """'prefix N' for an N past that of every 'prefix N.ext' file in folder and every name claimed by an
+    unfinished job manifest, so that a later run on the same day (e.g. the next incremental poll) or a job
+    resumed later never saves over an earlier run's images. Safe to call from concurrent jobs."""
+    key = (os.path.abspath(folder), prefix)
+    with _filename_lock:
+        if key not in _filename_indexes:
+            pattern = re.compile(re.escape(prefix) + r' (\d+)(\.|$)')
+            names = os.listdir(folder) if os.path.isdir(folder) else []
+            for path in unfinished_manifests(base_folder):
+                names.extend(JobManifest.load(path).items)
+            _filename_indexes[key] = max([int(match.group(1)) for match in map(pattern.match, names) if match],
+                                         default=0)
+        _filename_indexes[key] += 1
+        return prefix + ' ' + str(_filename_indexes[key])
+
+class DownloadJob:
+    """One (subreddit, sorting, num) download. Fetches the listing in the calling thread and hands
+    every image link to the shared download engine as soon as its listing page arrives."""
+
+    def __init__(self, sub: str, num: int, limit: int, sort: str, max_bytes: int = None,
+                 near_duplicate_distance: int = 6, incremental: bool = False,
+                 min_width: int = 0, min_height: int = 0, min_aspect: float = None, max_aspect: float = None):
+        self.subreddit = sub
+        self.num = num
+        self.limit = limit
+        self.sorting = sort
+        self.max_bytes = max_bytes
+        self.near_duplicate_distance = near_duplicate_distance
+        # only look at posts newer than the last incremental run of this subreddit and sorting
+        self.incremental = incremental
+        # images outside these limits are skipped, if possible without downloading them
+        self.size_filter = SizeFilter(min_width, min_height, min_aspect, max_aspect)
+        # the JobManifest file, set when the job starts, or when resuming a stopped job, see from_manifest
+        self.manifest_path = None
+
+    @classmethod
+    def from_manifest(cls, path: str) -> 'DownloadJob':
+        """The job recorded in the manifest at path (see unfinished_manifests), to be run again.
+        It downloads what is left, and finishes the listing if that was cut short."""
+        job = cls(**JobManifest.load(path).settings)
+        job.manifest_path = path
+        return job
+
+    def settings(self) -> dict:
+        """The constructor arguments of this job, as stored in its manifest."""
+        return {'sub': self.subreddit, 'num': self.num, 'limit': self.limit, 'sort': self.sorting,
+                'max_bytes': self.max_bytes, 'near_duplicate_distance': self.near_duplicate_distance,
+                'incremental': self.incremental, 'min_width': self.size_filter.min_width,
+                'min_height': self.size_filter.min_height, 'min_aspect': self.size_filter.min_aspect,
+                'max_aspect': self.size_filter.max_aspect}
+
+    def __str__(self):
+        return '/r/{} ({}, {} images)'.format(self.subreddit, self.sorting, self.num)
+
+    def download(self, scraper, image, filename: str, folder: str, engine, index: DedupIndex, phashes,
+                 progress=None, cancel: threading.Event = None, post_process=None, catalog=None) -> str:
+        """Downloads one image unless the index says it is already on disk.
+        With a size filter, images whose size is in the post's metadata were already checked in the listing
+        (see iter_image_posts); for the others the size comes from the image's header (see probe_size),
+        and images that don't pass are not downloaded; when that does not tell, the downloaded file is checked.
+        A fresh download that is a near-duplicate (by perceptual hash) of an image we already have is removed again.
+        phashes is a callable returning the PerceptualIndex, so that it is only loaded when needed.
+        Every image kept is recorded in the catalog, and new ones are handed to post_process(path), if given.
+        Returns 'downloaded', 'skipped', 'filtered', 'near-duplicate' or 'failed',
+        or 'cancelled' if cancel was set before it started."""
+        if cancel is not None and cancel.is_set():
+            return 'cancelled'
+        if index.lookup(image.url):
+            return 'skipped'
+        if progress is not None:
+            progress.update_item(self, filename, ACTIVE)
+        size = None
+        if self.size_filter:
+            size = (image.width, image.height) if image.width and image.height else scraper.probe_size(image.url, engine)
+            if size is not None and not self.size_filter.accepts(*size):
+                return 'filtered'
+        result = scraper.download_image(image.url, filename, folder, engine, self.max_bytes, image.ext)
+        if result is None:
+            return 'failed'
+        if progress is not None:
+            progress.update_item(self, filename, size=result.size)
+        if size is None:
+            size = (image.width, image.height) if image.width and image.height else read_image_size(result.path)
+            if self.size_filter and size is not None and not self.size_filter.accepts(*size):
+                os.remove(result.path)
+                return 'filtered'
+        exact_duplicate = index.path_for_content(result.sha256) is not None
+        path = index.add(image.url, image.post.id, result.sha256, result.path)
+        if not exact_duplicate and self.near_duplicate_distance >= 0 and \
+                self.is_near_duplicate(scraper, image, result, path, index, phashes):
+            return 'near-duplicate'
+        if catalog is not None:
+            catalog.add(path, image.post, image.url, *(size or (None, None)))
+        if post_process is not None and not exact_duplicate:
+            post_process(path)
+        return 'downloaded'
+
+    def is_near_duplicate(self, scraper, image, result, path: str, index: DedupIndex, phashes) -> bool:
+        """Checks a fresh download against the perceptual hash index. A near-duplicate is removed,
+        and its url recorded as available at the image it duplicates; anything else is added to the index."""
+        from .perceptualHash import dhash
+        with scraper.metrics.timer('perceptual_hash'):
+            try:
+                h = dhash(path)
+            except Exception:
+                return False
+            matches = phashes().find_or_add(path, h, self.near_duplicate_distance)
+        if matches:
+            os.remove(path)
+            index.record(image.url, image.post.id, result.sha256, matches[0][0])
+            return True
+        return False
+
+    def run(self, scraper, base_folder: str, engine, index: DedupIndex, phashes, report=print,
+            progress=None, cancel: threading.Event = None, post_process=None, catalog=None) -> collections.Counter:
+        """Runs the job to completion, passing progress messages to report. Returns a Counter of outcomes.
+        With a ProgressTracker, the state of every image is tracked there instead of reporting a running count.
+        Everything found and done is recorded in a JobManifest as it happens. Once cancel is set, no more
+        listing pages are fetched and queued images are not started, while downloads in progress finish;
+        the manifest is then left behind, so that the job can be resumed with from_manifest.
+        post_process(path) is called for every new image kept, and everything kept is added to the Catalog."""
+        folder = os.path.join(base_folder, self.subreddit)
+        cancel = cancel if cancel is not None else threading.Event()
+        resumed = self.manifest_path is not None
+        if resumed:
+            manifest = JobManifest.load(self.manifest_path)
+        else:
+            manifest = JobManifest.create(base_folder, self.settings(), str(datetime.datetime.now().date()))
+            self.manifest_path = manifest.path
+        stats = {'scanned': 0, 'pages': 0, 'filtered': 0, 'newest': None}
+        outcomes = collections.Counter()
+        lock = threading.Lock()
+
+        def done(future, filename):
+            outcome = future.result() if future.exception() is None else 'failed'
+            with lock:
+                outcomes[outcome] += 1
+                completed = sum(outcomes.values())
+            if outcome == 'cancelled':
+                return
+            manifest.set_status(filename, outcome)
+            scraper.metrics.count(outcome, subreddit=self.subreddit)
+            if progress is not None:
+                progress.update_item(self, filename, FAILED if outcome == 'failed' else DONE, outcome)
+            else:
+                report(str(completed) + ' ')
+
+        futures = []
+        def submit(filename, image):
+            if progress is not None:
+                progress.add_item(self, filename, image.url)
+            future = engine.submit(self.download, scraper, image, filename, folder, engine, index, phashes,
+                                   progress, cancel, post_process, catalog)
+            future.add_done_callback(lambda future, filename=filename: done(future, filename))
+            futures.append(future)
+
+        checkpoints = CheckpointStore(base_folder) if self.incremental else None
+        since = checkpoints.get(self.subreddit, self.sorting) if checkpoints else None
+
+        for filename, url, ext, post, width, height in manifest.pending():
+            submit(filename, ImagePost(url, post, ext, width, height))
+        if futures:
+            report('Resuming {}: {} images left from the last run.\n'.format(self, len(futures)))
+        if not manifest.listed and not cancel.is_set():
+            # a resumed listing starts over (mostly from the cache), skipping what the manifest already has
+            known = {item['url'] for item in manifest.items.values()}
+            images = scraper.iter_image_posts(self.subreddit, self.sorting, self.num, self.limit, stats, since,
+                                              self.size_filter, engine)
+            for image in images:
+                if cancel.is_set():
+                    break
+                if image.url in known:
+                    continue
+                filename = next_filename(base_folder, folder, manifest.date + ' ' + self.sorting)
+                manifest.add_item(filename, image)
+                submit(filename, image)
+            else:
+                manifest.set_listed(stats['newest'])
+        wait(futures)
+        if checkpoints is not None and manifest.listed and manifest.newest is not None:
+            checkpoints.set(self.subreddit, self.sorting, manifest.newest)
+
+        finished = manifest.listed and not outcomes['cancelled']
+        manifest.close(finished)
+        if not finished:
+            report('Stopped {}: {} of {} images found so far are done, resume to continue.\n'.format(
+                self, len(manifest.items) - len(manifest.pending()), len(manifest.items)))
+            return outcomes
+
+        found = len(futures)
+        if since is not None and stats['scanned'] == 0 and not resumed:
+            report('No new posts in /r/{} since the last run.\n'.format(self.subreddit))
+            return outcomes
+        report( '\n'+ str(found) + ' images from /r/' + self.subreddit + ', sorted by ' + self.sorting + '\n')
+        if outcomes['skipped']:
+            report('{} of them were already downloaded.\n'.format(outcomes['skipped']))
+        if stats['filtered']:
+            report('{} more images in the listing were not {}, and were passed over.\n'.format(
+                stats['filtered'], self.size_filter))
+        if outcomes['filtered']:
+            report('{} of them were not {}, and were left out.\n'.format(outcomes['filtered'], self.size_filter))
+        if outcomes['near-duplicate']:
+            report('{} of them were near-duplicates of images you already have, and were removed.\n'.format(outcomes['near-duplicate']))
+        if outcomes['failed']:
+            report('{} of them failed to download.\n'.format(outcomes['failed']))
+        if found == 0:
+            report('Searched {} posts, but could not find any images.\nPerhaps try a different subreddit?\n'.format(stats['scanned']))
+        elif found < self.num and not resumed:
+            report('Searched {} posts, but could only find {} images...\n'.format(stats['scanned'], found))
+        return outcomes
@@ -1,41 +1,123 @@
-import os
-import datetime
+import threading
 from PyQt5.QtCore import QThread, pyqtSignal
+from .export import export_listings
+from .perceptualHash import PerceptualIndex
+from .scheduler import JobQueue
+from .metrics import Metrics, JsonlSink, profiled
 
 class RedditDownloadThread(QThread):
-    """Defines the thread that runs the download."""
+    """Defines the thread that runs the downloads. Runs a JobQueue until all of its jobs are done;
+    more jobs can be added with add_job while it is running. With a ProgressTracker, messages and
+    progress go there, to be picked up by the window on a timer, instead of through changeText."""
 
     changeText = pyqtSignal(str)
 
-    def __init__(self, redditInstance, sub: str, num: int, limit:int, sort: str, base_folder:str):
+    def __init__(self, redditInstance, jobs: list, base_folder:str, workers: int = 8, concurrent_jobs: int = 4,
+                 metrics_file: str = None, profile_path: str = None, progress=None, post_process=None):
         QThread.__init__(self)
         self.reddit = redditInstance
-        self.subreddit = sub
-        self.num = num
+        self.jobs = list(jobs)
+        self.base_folder = base_folder
+        self.workers = workers
+        self.concurrent_jobs = concurrent_jobs
+        self.metrics_file = metrics_file
+        self.profile_path = profile_path
+        self.progress = progress
+        self.post_process = post_process
+        self.queue = None
+        self.stopping = False
+
+    def __del__(self):
+        self.wait()
+
+    def add_job(self, job) -> bool:
+        """Adds a job to the running queue. Returns False if the thread is not running (anymore)."""
+        queue = self.queue
+        if queue is None or not self.isRunning() or self.stopping:
+            return False
+        try:
+            queue.add(job)
+        except RuntimeError: # the queue has just shut down
+            return False
+        self.jobs.append(job)
+        return True
+
+    def stop(self):
+        """Asks the jobs to stop: nothing new is listed or started, downloads in progress finish,
+        and the thread ends once they have. The jobs are left resumable."""
+        self.stopping = True
+        queue = self.queue
+        if queue is not None:
+            queue.cancel()
+
+    def run(self):
+        """Runs the actual download, using various helper functions from the redditScraper class.
+        Metrics events are appended to metrics_file, and with a profile_path the run is profiled with cProfile."""
+        report = self.progress.report if self.progress is not None else self.changeText.emit
+        report('Downloading ...\n ------------------------------------------ \n')
+        metrics = Metrics([JsonlSink(self.metrics_file)] if self.metrics_file else [])
+        with profiled(self.profile_path):
+            with JobQueue(self.reddit, self.base_folder, self.workers, self.concurrent_jobs, report=report,
+                          progress=self.progress, post_process=self.post_process, metrics=metrics) as queue:
+                self.queue = queue
+                if self.stopping:
+                    queue.cancel()
+                for job in self.jobs:
+                    queue.add(job)
+                queue.join()
+                self.queue = None
+        metrics.close()
+        report("Stopped. Use File > Resume stopped downloads to continue.\n" if self.stopping else "Finished! \n")
+
+class DuplicateScanThread(QThread):
+    """Scans an existing folder for near-duplicate images in the background, using all cores for hashing."""
+
+    changeText = pyqtSignal(str)
+
+    def __init__(self, base_folder: str, folder: str, max_distance: int = 6):
+        QThread.__init__(self)
+        self.base_folder = base_folder
+        self.folder = folder
+        self.max_distance = max_distance
+
+    def __del__(self):
+        self.wait()
+
+    def run(self):
+        self.changeText.emit('Scanning {} for near-duplicates ...\n'.format(self.folder))
+        phashes = PerceptualIndex(self.base_folder)
+        groups = phashes.scan_folder(self.folder, self.max_distance)
+        phashes.save()
+        for group in groups:
+            self.changeText.emit('Near-duplicates:\n  ' + '\n  '.join(group) + '\n')
+        self.changeText.emit('Found {} groups of near-duplicates among {} images.\n'.format(len(groups), len(phashes)))
+
+class ExportThread(QThread):
+    """Exports the metadata of subreddit listings to a file in the background, see export_listings."""
+
+    changeText = pyqtSignal(str)
+
+    def __init__(self, redditInstance, path: str, subreddits: list, sorting: str, limit: int, base_folder: str):
+        QThread.__init__(self)
+        self.reddit = redditInstance
+        self.path = path
+        self.subreddits = subreddits
+        self.sorting = sorting
         self.limit = limit
-        self.sorting = sort
         self.base_folder = base_folder
+        self.cancel = threading.Event()
 
     def __del__(self):
         self.wait()
 
+    def stop(self):
+        """Stops after the listing page being exported; what was exported so far is kept."""
+        self.cancel.set()
+
     def run(self):
-        """Runs the actual download, using various helper functions from the redditScraper class."""
-        self.changeText.emit('Downloading ...\n ------------------------------------------ \n')
-        img_urls = self.reddit.get_image_urls(self.subreddit, self.sorting, self.num, self.limit)
-        folder = os.path.join(self.base_folder, self.subreddit)
-        date = str(datetime.datetime.now().date())
-
-        self.changeText.emit( '\n'+ str(len(img_urls)) + ' images from /r/' + self.subreddit + ', sorted by ' + self.sorting + '\n')
-
-        for i, url in enumerate(img_urls):
-            filename = date +' '+self.sorting + ' ' + str(i + 1)
-            self.reddit.download_image(url, filename, folder)
-            self.changeText.emit(str(i+1) + ' ')
-            self.msleep(500)
-        if len(img_urls) == 0:
-            self.changeText.emit('Searched {} posts, but could not find any images.\nPerhaps try a different subreddit?\n'.format(self.limit))
-        elif len(img_urls) < self.num:
-            self.changeText.emit('Searched {} posts, but could only find {} images...\n'.format(self.limit, len(img_urls)))
-
-        self.changeText.emit("Finished! \n")
\ No newline at end of file
+        self.changeText.emit('Exporting post metadata to {} ...\n'.format(self.path))
+        try:
+            export_listings(self.reddit, self.path, self.subreddits, self.sorting, self.limit, self.base_folder,
+                            report=self.changeText.emit, cancel=self.cancel)
+        except ImportError as e:
+            self.changeText.emit(str(e) + '\n')
@@ -0,0 +1,163 @@
+"""Exports the metadata of the posts in subreddit listings to JSONL, CSV or Parquet, for analysis elsewhere.
+Nothing in here may import Qt; pyarrow is only needed, and imported, for Parquet."""
+import csv
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from .dedupIndex import DedupIndex
+from .redditScraper import PAGE_SIZE, RESOLVE_WORKERS
+
+BATCH_SIZE = 1000 # rows written at a time, and the row group size of Parquet files
+EXPORT_FORMATS = {'.jsonl': 'jsonl', '.json': 'jsonl', '.csv': 'csv', '.parquet': 'parquet'}
+EXPORT_FIELDS = ('id', 'subreddit', 'created_utc', 'score', 'num_comments', 'title', 'author', 'permalink',
+                 'domain', 'over_18', 'url', 'media', 'local_paths')
+
+def export_format(path: str) -> str:
+    """'jsonl', 'csv' or 'parquet', from the extension of path."""
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in EXPORT_FORMATS:
+        raise ValueError('can only export to ' + ', '.join(EXPORT_FORMATS) + ' files')
+    return EXPORT_FORMATS[ext]
+
+class JsonlWriter:
+    def __init__(self, path: str):
+        self._file = open(path, 'w', encoding='utf-8')
+
+    def write(self, rows: list):
+        self._file.writelines(json.dumps(row, ensure_ascii=False) + '\n' for row in rows)
+
+    def close(self):
+        self._file.close()
+
+class CsvWriter:
+    """CSV with a header row; the media urls and local paths are joined with spaces."""
+
+    def __init__(self, path: str):
+        self._file = open(path, 'w', encoding='utf-8', newline='')
+        self._writer = csv.DictWriter(self._file, EXPORT_FIELDS)
+        self._writer.writeheader()
+
+    def write(self, rows: list):
+        self._writer.writerows(dict(row, media=' '.join(row['media']), local_paths=' '.join(row['local_paths']))
+                               for row in rows)
+
+    def close(self):
+        self._file.close()
+
+class ParquetWriter:
+    """Parquet with one row group per batch, so rows never pile up in memory before being written."""
+
+    def __init__(self, path: str):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError('exporting to Parquet needs pyarrow: pip install pyarrow') from None
+        self._pa = pa
+        self.schema = pa.schema([('id', pa.string()), ('subreddit', pa.string()), ('created_utc', pa.float64()),
+                                 ('score', pa.int64()), ('num_comments', pa.int64()), ('title', pa.string()),
+                                 ('author', pa.string()), ('permalink', pa.string()), ('domain', pa.string()),
+                                 ('over_18', pa.bool_()), ('url', pa.string()),
+                                 ('media', pa.list_(pa.string())), ('local_paths', pa.list_(pa.string()))])
+        self._writer = pq.ParquetWriter(path, self.schema)
+
+    def write(self, rows: list):
+        self._writer.write_table(self._pa.Table.from_pylist(rows, self.schema))
+
+    def close(self):
+        self._writer.close()
+
+WRITERS = {'jsonl': JsonlWriter, 'csv': CsvWriter, 'parquet': ParquetWriter}
+
+class MetadataExporter:
+    """Streams the posts of subreddit listings to a file, BATCH_SIZE rows at a time, so memory use does not
+    grow with the listing. Every row has the post's metadata, the images it links to as resolved by the
+    scraper (media), and those of them that were downloaded into base_folder (local_paths).
+    Listing pages go through the scraper's cache and API budget; while the next page is being fetched,
+    the links of the last one are resolved on a thread pool, so the listing requests set the pace."""
+
+    def __init__(self, scraper, path: str, base_folder: str = None, format: str = None, batch_size: int = BATCH_SIZE):
+        self.scraper = scraper
+        self.path = path
+        self.format = format or export_format(path)
+        self.batch_size = batch_size
+        self.index = DedupIndex(base_folder) if base_folder else None
+        self.exported = 0
+        self._batch = []
+        self._writer = WRITERS[self.format](path)
+        self._pool = ThreadPoolExecutor(RESOLVE_WORKERS)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def row(self, post) -> dict:
+        media = [resolution.url for resolution in self.scraper.image_urls(post)]
+        local_paths = [path for path in map(self.index.lookup, media) if path] if self.index is not None else []
+        return {'id': post.id, 'subreddit': post.subreddit, 'created_utc': post.created_utc, 'score': post.score,
+                'num_comments': post.num_comments, 'title': post.title, 'author': post.author,
+                'permalink': 'https://www.reddit.com' + post.permalink if post.permalink else None,
+                'domain': post.domain, 'over_18': post.over_18, 'url': post.url,
+                'media': media, 'local_paths': local_paths}
+
+    def export(self, sub: str, sorting: str, limit: int = None, cancel=None) -> int:
+        """Exports the first limit posts of a listing (all of it if None), or until cancel is set.
+        Returns the number of posts exported."""
+        count = 0
+        resolving = []
+        # paged like iter_image_posts pages a download of limit posts, so those pages come from the cache
+        for page in self.scraper.listing_pages(sub, sorting, first_page=limit or PAGE_SIZE):
+            if limit is not None:
+                page = page[:limit - count]
+            count += len(page)
+            # resolved in the background while the listing generator fetches the next page
+            futures = [self._pool.submit(self.row, post) for post in page]
+            self._add(future.result() for future in resolving)
+            resolving = futures
+            if (limit is not None and count >= limit) or (cancel is not None and cancel.is_set()):
+                break
+        self._add(future.result() for future in resolving)
+        self.scraper.metrics.count('posts_exported', count, subreddit=sub)
+        return count
+
+    def _add(self, rows):
+        self._batch.extend(rows)
+        while len(self._batch) >= self.batch_size:
+            self._write(self._batch[:self.batch_size])
+            del self._batch[:self.batch_size]
+
+    def _write(self, rows: list):
+        with self.scraper.metrics.timer('export_write', rows=len(rows)):
+            self._writer.write(rows)
+        self.exported += len(rows)
+
+    def close(self):
+        """Writes the last, partial batch and closes the file."""
+        self._pool.shutdown(wait=True)
+        try:
+            if self._batch:
+                self._write(self._batch)
+                self._batch = []
+        finally:
+            self._writer.close()
+            if self.index is not None:
+                self.index.close()
+
+def export_listings(scraper, path: str, subreddits: list, sorting: str, limit: int = None, base_folder: str = None,
+                    report=print, cancel=None) -> int:
+    """Exports the first limit posts of the sorting listing of every subreddit to path, see MetadataExporter.
+    Returns the number of posts exported."""
+    with MetadataExporter(scraper, path, base_folder) as exporter:
+        for sub in subreddits:
+            if cancel is not None and cancel.is_set():
+                break
+            if not scraper.sub_exists(sub):
+                report('/r/{} does not exist, skipping it.\n'.format(sub))
+                continue
+            count = exporter.export(sub, sorting, limit, cancel)
+            report('Exported {} posts from /r/{}, sorted by {}.\n'.format(count, sub, sorting))
+    report('Wrote the metadata of {} posts to {}.\n'.format(exporter.exported, path))
+    return exporter.exported
@@ -0,0 +1,162 @@
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from PyQt5.QtCore import (QAbstractListModel, QModelIndex, QObject, QRunnable, QSize, QThreadPool, Qt,
+                          pyqtSignal)
+from PyQt5.QtGui import QImage, QImageReader, QPixmap
+from PyQt5.QtWidgets import QListView
+
+from .storage import state_folder
+
+THUMBNAIL_SIZE = 160
+THUMBNAILS_IN_MEMORY = 1000
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp')
+
+def thumbnail_cache_path(cache_folder: str, path: str) -> str:
+    """Sidecar file for the thumbnail of path. The key includes the file's mtime and size,
+    so an edited or replaced image gets a fresh thumbnail."""
+    stat = os.stat(path)
+    key = '{}|{}|{}'.format(os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+    return os.path.join(cache_folder, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.jpg')
+
+class _ThumbnailSignals(QObject):
+    """done is emitted for every task that ran, with a null image if the file could not be decoded.
+    started holds the paths of the tasks that have left the queue and not reported back yet."""
+
+    done = pyqtSignal(str, QImage)
+
+    def __init__(self):
+        super().__init__()
+        self.lock = threading.Lock()
+        self.started = set()
+
+class _ThumbnailTask(QRunnable):
+    """Loads a thumbnail from the sidecar cache, or decodes the image at thumbnail size and stores it there."""
+
+    def __init__(self, path: str, cache_folder: str, signals: _ThumbnailSignals):
+        super().__init__()
+        self.path = path
+        self.cache_folder = cache_folder
+        self.signals = signals
+
+    def run(self):
+        with self.signals.lock:
+            self.signals.started.add(self.path)
+        try:
+            image = self.load()
+        except OSError:
+            image = QImage()
+        self.signals.done.emit(self.path, image)
+
+    def load(self) -> QImage:
+        cached = thumbnail_cache_path(self.cache_folder, self.path)
+        image = QImage(cached) if os.path.exists(cached) else QImage()
+        if image.isNull():
+            reader = QImageReader(self.path)
+            size = reader.size()
+            if size.isValid():
+                # decoding straight to the small size is much cheaper than decoding fully and scaling
+                reader.setScaledSize(size.scaled(THUMBNAIL_SIZE, THUMBNAIL_SIZE, Qt.KeepAspectRatio))
+            image = reader.read()
+            if image.isNull():
+                return image
+            if image.width() > THUMBNAIL_SIZE or image.height() > THUMBNAIL_SIZE:
+                image = image.scaled(THUMBNAIL_SIZE, THUMBNAIL_SIZE, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+            # written next to the sidecar and renamed into place, so a half-written thumbnail is never loaded
+            fd, tmp_path = tempfile.mkstemp(suffix='.part', dir=self.cache_folder)
+            os.close(fd)
+            if image.save(tmp_path, 'JPG', 85):
+                os.replace(tmp_path, cached)
+            else:
+                os.remove(tmp_path)
+        return image
+
+class ThumbnailModel(QAbstractListModel):
+    """List model of the images in one folder. Thumbnails are only produced when the view asks for the
+    decoration of a row, i.e. for rows that are actually visible, and at most THUMBNAILS_IN_MEMORY of them
+    are kept, so memory does not grow with the size of the folder."""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.paths = []
+        self.cache_folder = None
+        self._rows = {}
+        self._thumbnails = OrderedDict()
+        self._pending = set()
+        self._failed = set()
+        self._pool = QThreadPool(self)
+        self._signals = _ThumbnailSignals()
+        self._signals.done.connect(self._on_thumbnail)
+
+    def set_folder(self, folder: str, base_folder: str):
+        self.beginResetModel()
+        self.cancel_pending()
+        self.cache_folder = os.path.join(state_folder(base_folder), 'thumbnails')
+        os.makedirs(self.cache_folder, exist_ok=True)
+        with os.scandir(folder) as entries:
+            self.paths = sorted(e.path for e in entries if e.is_file() and e.name.lower().endswith(IMAGE_EXTENSIONS))
+        self._rows = {path: row for row, path in enumerate(self.paths)}
+        self._thumbnails.clear()
+        self._failed.clear()
+        self.endResetModel()
+
+    def cancel_pending(self):
+        """Drops queued thumbnail jobs, e.g. for rows that were scrolled past. Visible rows ask again on repaint.
+        Jobs already running stay pending, so that they are not queued a second time."""
+        self._pool.clear()
+        with self._signals.lock:
+            self._pending &= self._signals.started
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.paths)
+
+    def data(self, index: QModelIndex, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        path = self.paths[index.row()]
+        if role == Qt.DecorationRole:
+            if path in self._thumbnails:
+                self._thumbnails.move_to_end(path)
+                return self._thumbnails[path]
+            if path not in self._pending and path not in self._failed:
+                self._pending.add(path)
+                self._pool.start(_ThumbnailTask(path, self.cache_folder, self._signals))
+            return None
+        if role == Qt.ToolTipRole:
+            return os.path.basename(path)
+        return None
+
+    def _on_thumbnail(self, path: str, image: QImage):
+        with self._signals.lock:
+            self._signals.started.discard(path)
+        self._pending.discard(path)
+        if image.isNull():
+            self._failed.add(path)
+            return
+        row = self._rows.get(path)
+        if row is None:
+            return
+        self._thumbnails[path] = QPixmap.fromImage(image)
+        while len(self._thumbnails) > THUMBNAILS_IN_MEMORY:
+            self._thumbnails.popitem(last=False)
+        index = self.index(row)
+        self.dataChanged.emit(index, index, [Qt.DecorationRole])
+
+class GalleryView(QListView):
+    """Grid of thumbnails, see ThumbnailModel."""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setViewMode(QListView.IconMode)
+        self.setResizeMode(QListView.Adjust)
+        self.setMovement(QListView.Static)
+        self.setUniformItemSizes(True)
+        self.setLayoutMode(QListView.Batched)
+        self.setIconSize(QSize(THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+        self.setGridSize(QSize(THUMBNAIL_SIZE + 8, THUMBNAIL_SIZE + 8))
+
+    def setModel(self, model: ThumbnailModel):
+        super().setModel(model)
+        self.verticalScrollBar().valueChanged.connect(model.cancel_pending)
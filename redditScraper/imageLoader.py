@@ -0,0 +1,99 @@
+import os
+from collections import OrderedDict
+from PyQt5.QtCore import QObject, QRunnable, QSize, QThreadPool, Qt, pyqtSignal
+from PyQt5.QtGui import QImage, QImageReader, QPixmap
+
+CACHE_BYTES = 256 * 1024 * 1024
+
+def scaled_size(size: QSize, scale_height: int) -> QSize:
+    """size scaled to scale_height, keeping its aspect ratio."""
+    return QSize(max(1, round(size.width() * scale_height / size.height())), scale_height)
+
+class _DecodeSignals(QObject):
+    done = pyqtSignal(object, QImage, bool)
+
+class _DecodeTask(QRunnable):
+    """Decodes (and optionally scales) one image on a pool thread. QImage is safe to use off the GUI thread,
+    the conversion to QPixmap happens back on the GUI thread. A scaled image is decoded straight at the
+    target size, so a large photo never takes up its full resolution in memory (JPEGs are scaled while decoding).
+    Also finds out whether the image is animated, by checking for a second frame after the first."""
+
+    def __init__(self, key: tuple, signals: _DecodeSignals):
+        super().__init__()
+        self.key = key
+        self.signals = signals
+
+    def run(self):
+        path, _, scale_height = self.key
+        reader = QImageReader(path)
+        size = reader.size()
+        if scale_height and size.isValid() and size.height():
+            reader.setScaledSize(scaled_size(size, scale_height))
+            scale_height = None
+        image = reader.read()
+        animated = reader.supportsAnimation() and reader.canRead()
+        if scale_height and not image.isNull(): # the size was not known up front
+            image = image.scaledToHeight(scale_height, Qt.SmoothTransformation)
+        self.signals.done.emit(self.key, image, animated)
+
+class PixmapCache(QObject):
+    """Memory-bounded LRU cache of decoded pixmaps, keyed by path, modification time and scale height.
+    Misses are decoded on a thread pool; `loaded` is emitted on the GUI thread when one is ready.
+    For an animated image the pixmap is its first frame, and the entry says it is animated."""
+
+    loaded = pyqtSignal(str, object, QPixmap, bool)
+
+    def __init__(self, max_bytes: int = CACHE_BYTES, parent=None):
+        super().__init__(parent)
+        self.max_bytes = max_bytes
+        self._cache = OrderedDict()
+        self._size = 0
+        self._pending = set()
+        self._pool = QThreadPool(self)
+        self._signals = _DecodeSignals()
+        self._signals.done.connect(self._on_decoded)
+
+    @staticmethod
+    def _key(path: str, scale_height) -> tuple:
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            mtime = None
+        return (path, mtime, scale_height)
+
+    def get(self, path: str, scale_height=None) -> tuple:
+        """Returns the cached (pixmap, animated), or None after starting a high-priority decode."""
+        key = self._key(path, scale_height)
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+        self._start(key, priority=1)
+        return None
+
+    def prefetch(self, path: str, scale_height=None):
+        """Decodes path in the background at low priority, unless it is cached already."""
+        key = self._key(path, scale_height)
+        if key not in self._cache:
+            self._start(key, priority=0)
+
+    def _start(self, key: tuple, priority: int):
+        if key in self._pending:
+            return
+        self._pending.add(key)
+        self._pool.start(_DecodeTask(key, self._signals), priority)
+
+    def _on_decoded(self, key: tuple, image: QImage, animated: bool):
+        self._pending.discard(key)
+        if image.isNull():
+            return
+        pixmap = QPixmap.fromImage(image)
+        self._cache[key] = (pixmap, animated)
+        self._size += self._cost(pixmap)
+        while self._size > self.max_bytes and len(self._cache) > 1:
+            _, (evicted, _) = self._cache.popitem(last=False)
+            self._size -= self._cost(evicted)
+        self.loaded.emit(key[0], key[2], pixmap, animated)
+
+    @staticmethod
+    def _cost(pixmap: QPixmap) -> int:
+        return pixmap.width() * pixmap.height() * max(pixmap.depth(), 8) // 8
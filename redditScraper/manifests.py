@@ -0,0 +1,121 @@
+import os
+import glob
+import json
+import time
+import threading
+from collections import OrderedDict
+from types import SimpleNamespace
+
+from .storage import state_folder
+
+MANIFEST_FOLDER = 'jobs'
+# statuses after which an image is not downloaded again on resume
+COMPLETED_STATUSES = ('downloaded', 'skipped', 'filtered', 'near-duplicate')
+# post fields only needed to resolve the image urls, which the manifest already has
+RESOLVER_FIELDS = ('media_metadata', 'gallery_data', 'preview')
+
+def manifest_folder(base_folder: str) -> str:
+    folder = os.path.join(state_folder(base_folder), MANIFEST_FOLDER)
+    os.makedirs(folder, exist_ok=True)
+    return folder
+
+def unfinished_manifests(base_folder: str) -> list:
+    """The manifests of the jobs into base_folder that were stopped or crashed, oldest first."""
+    return sorted(glob.glob(os.path.join(manifest_folder(base_folder), '*.jsonl')))
+
+class JobManifest:
+    """On-disk record of one DownloadJob, so that a stopped or crashed job can be resumed without
+    listing the subreddit again or downloading what it already has.
+    An append-only JSON lines file in the state folder: a header with the job's settings, then a line
+    per image found (url, extension, size if known, target filename and the post), one per status change, and one
+    when the listing is complete. Every line is flushed as it is written, so at most the line being
+    written when the process dies is lost; load() ignores that partial line, and a resumed run starts on the next one.
+    The file is deleted once the job has finished."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.settings = {}
+        self.date = None
+        self.items = OrderedDict() # filename -> {'url', 'ext', 'post', 'status'}
+        self.listed = False
+        self.newest = None
+        self._lock = threading.Lock()
+        self._file = None
+
+    @classmethod
+    def create(cls, base_folder: str, settings: dict, date: str) -> 'JobManifest':
+        """Starts the manifest of a new job; settings are the job's constructor arguments."""
+        name = '{}-{}-{}.jsonl'.format(time.strftime('%Y%m%d-%H%M%S'), settings['sub'],
+                                       settings['sort'].replace(' ', '_'))
+        manifest = cls(os.path.join(manifest_folder(base_folder), name))
+        manifest.settings = settings
+        manifest.date = date
+        with manifest._lock:
+            manifest._write({'job': settings, 'date': date})
+        return manifest
+
+    @classmethod
+    def load(cls, path: str) -> 'JobManifest':
+        manifest = cls(path)
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError: # cut off mid-line by a crash; later lines were appended by a resumed run
+                    continue
+                if 'job' in entry:
+                    manifest.settings, manifest.date = entry['job'], entry['date']
+                elif 'item' in entry:
+                    manifest.items[entry['item']] = {'url': entry['url'], 'ext': entry['ext'], 'post': entry['post'],
+                                                     'width': entry.get('width'), 'height': entry.get('height'),
+                                                     'status': None}
+                elif 'status' in entry and entry['name'] in manifest.items:
+                    manifest.items[entry['name']]['status'] = entry['status']
+                elif 'listed' in entry:
+                    manifest.listed, manifest.newest = True, entry['newest']
+        return manifest
+
+    def _write(self, entry: dict):
+        """Appends entry; the caller holds the lock."""
+        if self._file is None:
+            self._file = open(self.path, 'a+b')
+            if self._file.tell() > 0:
+                self._file.seek(-1, os.SEEK_END)
+                if self._file.read(1) != b'\n': # the line being written when the process died
+                    self._file.write(b'\n')
+        self._file.write(json.dumps(entry).encode('utf-8') + b'\n')
+        self._file.flush()
+
+    def add_item(self, filename: str, image):
+        """Records an ImagePost found in the listing, to be saved as filename."""
+        post = {key: value for key, value in vars(image.post).items() if key not in RESOLVER_FIELDS}
+        entry = {'url': image.url, 'ext': image.ext, 'post': post, 'width': image.width, 'height': image.height}
+        with self._lock:
+            self.items[filename] = dict(entry, status=None)
+            self._write(dict(entry, item=filename))
+
+    def set_status(self, filename: str, status: str):
+        with self._lock:
+            self.items[filename]['status'] = status
+            self._write({'name': filename, 'status': status})
+
+    def set_listed(self, newest: dict):
+        """Marks the listing as complete; newest is the incremental checkpoint it reached."""
+        with self._lock:
+            self.listed, self.newest = True, newest
+            self._write({'listed': True, 'newest': newest})
+
+    def pending(self) -> list:
+        """(filename, url, ext, post record, width, height) of every image not downloaded yet, failed ones included."""
+        with self._lock:
+            return [(filename, item['url'], item['ext'], SimpleNamespace(**item['post']), item['width'], item['height'])
+                    for filename, item in self.items.items() if item['status'] not in COMPLETED_STATUSES]
+
+    def close(self, finished: bool):
+        """Closes the file, and deletes it if the job is finished."""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+        if finished and os.path.exists(self.path):
+            os.remove(self.path)
@@ -0,0 +1,137 @@
+import json
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+class JsonlSink:
+    """Appends every event to a file as one JSON object per line."""
+
+    def __init__(self, path: str):
+        self._file = open(path, 'a', buffering=64 * 1024)
+        self._lock = threading.Lock()
+
+    def __call__(self, event: dict):
+        line = json.dumps(event, separators=(',', ':')) + '\n'
+        with self._lock:
+            self._file.write(line)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+class Metrics:
+    """Thread-safe collector of per-stage timings and counters for scrape and download runs.
+    Keeps running aggregates for summary(), and passes every record as a structured event dict
+    to the sinks (callables, e.g. a JsonlSink). Recording is a lock and a few dict updates,
+    cheap enough to leave on all the time."""
+
+    def __init__(self, sinks=()):
+        self.sinks = list(sinks)
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._counters = defaultdict(int)
+        self._timings = defaultdict(lambda: [0, 0.0, 0.0]) # stage -> [count, total, max]
+        self._hosts = defaultdict(lambda: [0, 0.0]) # host -> [requests, total latency]
+
+    def _emit(self, event: dict):
+        for sink in self.sinks:
+            sink(event)
+
+    def count(self, name: str, n: int = 1, **fields):
+        with self._lock:
+            self._counters[name] += n
+        if self.sinks:
+            self._emit(dict(fields, ts=time.time(), type='count', name=name, n=n))
+
+    def observe(self, stage: str, seconds: float, **fields):
+        """Records that one run of stage took seconds. A host field also counts towards that host's latency."""
+        with self._lock:
+            timing = self._timings[stage]
+            timing[0] += 1
+            timing[1] += seconds
+            timing[2] = max(timing[2], seconds)
+            if 'host' in fields:
+                self._hosts[fields['host']][0] += 1
+                self._hosts[fields['host']][1] += seconds
+        if self.sinks:
+            self._emit(dict(fields, ts=time.time(), type='timing', stage=stage, seconds=seconds))
+
+    @contextmanager
+    def timer(self, stage: str, **fields):
+        """Times the with block as one run of stage. Fields can be added to the yielded dict inside the block."""
+        start = time.perf_counter()
+        try:
+            yield fields
+        finally:
+            self.observe(stage, time.perf_counter() - start, **fields)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {'counters': dict(self._counters),
+                    'timings': {stage: {'count': c, 'total': t, 'max': m} for stage, (c, t, m) in self._timings.items()},
+                    'hosts': {host: {'requests': c, 'mean_latency': t / c} for host, (c, t) in self._hosts.items()}}
+
+    def summary(self) -> str:
+        """Human readable summary of the run so far."""
+        data = self.snapshot()
+        counters = data['counters']
+        lines = ['Run summary ({:.1f} s):'.format(time.time() - self.started)]
+        scanned = counters.get('posts_scanned', 0)
+        if scanned:
+            lines.append('  {} listing pages, {} posts scanned, {} images found ({:.0%} hit rate)'.format(
+                counters.get('listing_pages', 0), scanned, counters.get('images_found', 0),
+                counters.get('images_found', 0) / scanned))
+        if counters.get('bytes'):
+            lines.append('  {:.1f} MB downloaded, {} retries'.format(counters['bytes'] / 1e6, counters.get('retries', 0)))
+        for stage, t in sorted(data['timings'].items()):
+            lines.append('  {:<16} {:>6} x  {:8.3f} s total  {:7.3f} s mean  {:7.3f} s max'.format(
+                stage, t['count'], t['total'], t['total'] / t['count'], t['max']))
+        for host, h in sorted(data['hosts'].items()):
+            lines.append('  {:<24} {:>6} requests  {:6.3f} s mean'.format(host, h['requests'], h['mean_latency']))
+        return '\n'.join(lines) + '\n'
+
+    def close(self):
+        for sink in self.sinks:
+            if hasattr(sink, 'close'):
+                sink.close()
+
+@contextmanager
+def profiled(path: str = None):
+    """Runs the with block under cProfile and dumps the stats to path; does nothing without a path.
+    Threads started inside the block, i.e. the download and listing workers, are profiled too. Before
+    Python 3.12 each one gets a profiler of its own, and their stats are merged when the block ends;
+    from 3.12 the one profiler sees every thread, but calls on different threads share its call stack,
+    so the call counts are right while the cumulative times of overlapping calls are not."""
+    if path is None:
+        yield
+        return
+    import cProfile
+    import pstats
+    profiles = [cProfile.Profile()]
+    per_thread = sys.version_info < (3, 12)
+    if per_thread:
+        lock = threading.Lock()
+
+        def start_thread_profile(*args):
+            # called on the first event of every new thread; the thread's own profiler takes over from here
+            sys.setprofile(None)
+            profile = cProfile.Profile()
+            with lock:
+                profiles.append(profile)
+            profile.enable()
+
+        threading.setprofile(start_thread_profile)
+    profiles[0].enable()
+    try:
+        yield
+    finally:
+        profiles[0].disable()
+        if per_thread:
+            threading.setprofile(None)
+            with lock:
+                stats = pstats.Stats(*profiles)
+        else:
+            stats = pstats.Stats(profiles[0])
+        stats.dump_stats(path)
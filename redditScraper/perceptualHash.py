@@ -0,0 +1,181 @@
+import json
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from .storage import state_folder
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp')
+HASH_SIZE = 8 # 8x8 gradient bits = one 64-bit hash
+# bits set in every byte value, used to count differing bits when numpy has no bitwise_count
+POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+# taken while an index merges with and rewrites its files, see PerceptualIndex.save
+_save_lock = threading.Lock()
+
+def dhash(path: str) -> int:
+    """Difference hash of an image: one bit per horizontally adjacent pixel pair of a 9x8 grayscale thumbnail.
+    Re-encoded or slightly resized copies of an image end up only a few bits apart."""
+    with Image.open(path) as img:
+        img.draft('L', (HASH_SIZE * 4, HASH_SIZE * 4)) # lets JPEGs decode at reduced size
+        small = img.convert('L').resize((HASH_SIZE + 1, HASH_SIZE), Image.LANCZOS)
+    pixels = np.asarray(small, dtype=np.int16)
+    bits = pixels[:, 1:] > pixels[:, :-1]
+    return int(np.packbits(bits).view('>u8')[0])
+
+def _hash_file(path: str):
+    """Process pool worker for scan_folder; unreadable files are returned with a None hash."""
+    try:
+        return path, dhash(path)
+    except Exception:
+        return path, None
+
+def hamming_distances(hashes: np.ndarray, h: int) -> np.ndarray:
+    """Number of differing bits between h and every hash in the uint64 array, fully vectorized."""
+    xor = hashes ^ np.uint64(h)
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(xor)
+    return POPCOUNT[xor.view(np.uint8)].reshape(-1, 8).sum(axis=1, dtype=np.uint8)
+
+class PerceptualIndex:
+    """Compact index of 64-bit perceptual hashes for the images under a base folder.
+    Hashes live in one growable uint64 array (8 bytes per image), so a query against a
+    library of 200k images is a single vectorized xor/popcount pass taking about a millisecond.
+    Stored as phash.npy plus a json list of paths in the state folder. Several indexes of one base folder
+    (a download and a duplicate scan, or two processes) can be open at once: save() merges in what the
+    others saved in the meantime."""
+
+    def __init__(self, base_folder: str):
+        folder = state_folder(base_folder)
+        self.hash_path = os.path.join(folder, 'phash.npy')
+        self.paths_path = os.path.join(folder, 'phash_paths.json')
+        self._lock = threading.Lock()
+        self._hashes = np.zeros(1024, dtype=np.uint64)
+        self._paths = []
+        self._known = set()
+        paths, stored = self._load()
+        if paths:
+            self._hashes = np.zeros(max(1024, 2 * len(paths)), dtype=np.uint64)
+            self._hashes[:len(paths)] = stored
+            self._paths = paths
+            self._known = set(paths)
+
+    def _load(self) -> tuple:
+        """The saved (paths, hashes); paths beyond the saved hashes, left by a crash between writing the two, are dropped."""
+        if not (os.path.exists(self.hash_path) and os.path.exists(self.paths_path)):
+            return [], None
+        with open(self.paths_path) as f:
+            paths = json.load(f)
+        stored = np.load(self.hash_path)
+        del paths[len(stored):]
+        return paths, stored[:len(paths)]
+
+    def __len__(self):
+        return len(self._paths)
+
+    def __contains__(self, path: str):
+        return path in self._known
+
+    def add(self, path: str, h: int):
+        with self._lock:
+            self._add(path, h)
+
+    def _add(self, path: str, h: int):
+        """Appends a hash; the caller holds the lock."""
+        n = len(self._paths)
+        if n == len(self._hashes):
+            grown = np.zeros(2 * n, dtype=np.uint64)
+            grown[:n] = self._hashes
+            self._hashes = grown
+        self._hashes[n] = np.uint64(h)
+        self._paths.append(path)
+        self._known.add(path)
+
+    def move(self, old_path: str, new_path: str):
+        """Keeps the hash of the file at old_path, which is now at new_path."""
+        with self._lock:
+            if old_path in self._known:
+                self._paths[self._paths.index(old_path)] = new_path
+                self._known.discard(old_path)
+                self._known.add(new_path)
+
+    def find(self, h: int, max_distance: int = 6, exclude: str = None) -> list:
+        """Returns [(path, distance)] of indexed images within max_distance bits of h, closest first.
+        Files that have been deleted since they were indexed are left out."""
+        with self._lock:
+            return self._find(h, max_distance, exclude)
+
+    def find_or_add(self, path: str, h: int, max_distance: int = 6) -> list:
+        """find(h, max_distance) for the image at path, and adds it if that finds nothing, in one step,
+        so that of two near-duplicates checked at the same time only the first is added."""
+        with self._lock:
+            matches = self._find(h, max_distance, path)
+            if not matches:
+                self._add(path, h)
+            return matches
+
+    def _find(self, h: int, max_distance: int, exclude: str) -> list:
+        n = len(self._paths)
+        distances = hamming_distances(self._hashes[:n], h)
+        hits = np.flatnonzero(distances <= max_distance)
+        matches = [(self._paths[i], int(distances[i])) for i in hits[np.argsort(distances[hits])]]
+        return [(path, d) for path, d in matches if path != exclude and os.path.exists(path)]
+
+    def save(self):
+        """Writes the index, after adding what another index of the same folder saved since this one was
+        loaded (the files it has that this one doesn't know and that still exist). Both files are written to
+        temp files and renamed into place, hashes first, so a crash never leaves them half written or out of step."""
+        with _save_lock, self._lock:
+            paths, stored = self._load()
+            for path, h in zip(paths, stored if stored is not None else ()):
+                if path not in self._known and os.path.exists(path):
+                    self._add(path, int(h))
+            n = len(self._paths)
+            self._write(self.hash_path, lambda f: np.save(f, self._hashes[:n]), 'wb')
+            self._write(self.paths_path, lambda f: json.dump(self._paths, f), 'w')
+
+    @staticmethod
+    def _write(path: str, write, mode: str):
+        folder, name = os.path.split(path)
+        fd, tmp_path = tempfile.mkstemp(prefix='.' + name + '.', suffix='.part', dir=folder)
+        try:
+            with os.fdopen(fd, mode) as f:
+                write(f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def scan_folder(self, folder: str, max_distance: int = 6, workers: int = None) -> list:
+        """Bulk mode: hashes every image under folder that is not indexed yet, using a process per core,
+        then returns groups of near-duplicate paths (each group a list, the first one indexed first)."""
+        new_paths = []
+        for root, dirs, files in os.walk(folder):
+            dirs[:] = [d for d in dirs if not d.startswith('.')]
+            new_paths += [os.path.join(root, f) for f in files
+                          if f.lower().endswith(IMAGE_EXTENSIONS) and os.path.join(root, f) not in self]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for path, h in pool.map(_hash_file, new_paths, chunksize=64):
+                if h is not None:
+                    self.add(path, h)
+
+        groups = []
+        grouped = set()
+        with self._lock:
+            n = len(self._paths)
+            hashes = self._hashes[:n]
+            for i in range(n):
+                if i in grouped:
+                    continue
+                # only later entries need checking, earlier pairs were compared already
+                distances = hamming_distances(hashes[i + 1:], int(hashes[i]))
+                close = [i + 1 + j for j in np.flatnonzero(distances <= max_distance) if i + 1 + j not in grouped]
+                if close:
+                    grouped.update(close)
+                    groups.append([self._paths[i]] + [self._paths[j] for j in close])
+        return [[p for p in group if os.path.exists(p)] for group in groups
+                if sum(os.path.exists(p) for p in group) > 1]
@@ -0,0 +1,169 @@
+import os
+import hashlib
+import queue
+import time
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from .redditScraper import place_file
+
+# what PostProcessOptions.format can be; None keeps every image in its own format
+FORMATS = {'webp': 'WEBP', 'avif': 'AVIF', 'jpg': 'JPEG', 'png': 'PNG'}
+PIL_EXTENSIONS = {'JPEG': 'jpg', 'PNG': 'png', 'GIF': 'gif', 'WEBP': 'webp', 'AVIF': 'avif'}
+
+class PostProcessOptions:
+    """What to do with every downloaded image: re-encode it to format ('webp', 'avif', 'jpg', 'png')
+    at quality, shrink it to fit max_width x max_height, and/or drop its EXIF data and ICC profile.
+    Options without any of these do nothing and are false."""
+
+    def __init__(self, format: str = None, quality: int = 80, max_width: int = None, max_height: int = None,
+                 strip_metadata: bool = False):
+        if format is not None and format not in FORMATS:
+            raise ValueError('can only re-encode to ' + ', '.join(FORMATS))
+        self.format = format
+        self.quality = quality
+        self.max_width = max_width
+        self.max_height = max_height
+        self.strip_metadata = strip_metadata
+
+    def __bool__(self):
+        return bool(self.format or self.max_width or self.max_height or self.strip_metadata)
+
+def process_image(path: str, options: PostProcessOptions) -> tuple:
+    """Process pool worker: applies options to the image at path. The result is written next to it and
+    replaces it, under a new extension if the format changed, unless it came out larger without being
+    resized, in which case the original is kept. Animated images are left alone. A file already at the new
+    path is never replaced; that raises FileExistsError, and the original is kept.
+    Returns (new path, old size, new size, CPU seconds, SHA-256 of the new file or None if it was kept)."""
+    from PIL import Image
+    try: # AVIF support for Pillow versions before 11.2
+        import pillow_avif
+    except ImportError:
+        pass
+
+    started = time.process_time()
+    old_size = os.path.getsize(path)
+    with Image.open(path) as img:
+        if getattr(img, 'is_animated', False):
+            return path, old_size, old_size, time.process_time() - started, None
+        pil_format = FORMATS[options.format] if options.format else img.format
+        resized = False
+        if options.max_width or options.max_height:
+            bounds = (options.max_width or img.width, options.max_height or img.height)
+            if img.width > bounds[0] or img.height > bounds[1]:
+                img.draft(img.mode, bounds) # lets JPEGs decode at reduced size
+                img = img.copy()
+                img.thumbnail(bounds, Image.LANCZOS)
+                resized = True
+        save_options = {'quality': options.quality}
+        if not options.strip_metadata:
+            for key in ('exif', 'icc_profile'):
+                if img.info.get(key):
+                    save_options[key] = img.info[key]
+        if pil_format == 'JPEG' and img.mode not in ('RGB', 'L'):
+            img = img.convert('RGB')
+        new_path = os.path.splitext(path)[0] + '.' + PIL_EXTENSIONS.get(pil_format, pil_format.lower())
+        folder, name = os.path.split(new_path)
+        fd, tmp_path = tempfile.mkstemp(prefix='.' + name + '.', suffix='.part', dir=folder)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                img.save(f, pil_format, **save_options)
+            new_size = os.path.getsize(tmp_path)
+            if new_size >= old_size and not resized:
+                os.remove(tmp_path)
+                return path, old_size, old_size, time.process_time() - started, None
+            sha256 = _file_sha256(tmp_path)
+            if new_path == path:
+                os.replace(tmp_path, new_path)
+            else: # another download may already have that name
+                place_file(tmp_path, new_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+    if new_path != path:
+        os.remove(path)
+    return new_path, old_size, new_size, time.process_time() - started, sha256
+
+def _file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+class PostProcessor:
+    """Runs process_image on downloaded images in a pool of processes, so re-encoding uses every core
+    without holding up the download threads or the GUI. submit only queues the path; one dispatcher thread
+    hands the queued paths to the pool, with at most max_pending images being decoded and encoded at a time,
+    which bounds memory when downloads outpace the encoder while download workers never wait for it.
+    Keeps totals of the space saved and CPU time used, see summary()."""
+
+    def __init__(self, options: PostProcessOptions, workers: int = None, max_pending: int = None, metrics=None):
+        self.options = options
+        self._pool = ProcessPoolExecutor(max_workers=workers)
+        self._slots = threading.BoundedSemaphore(max_pending or 2 * (workers or os.cpu_count() or 1))
+        self._lock = threading.Lock()
+        self.metrics = metrics
+        self.processed = self.failed = 0
+        self.bytes_before = self.bytes_after = 0
+        self.cpu_time = 0.0
+        self._queue = queue.Queue()
+        self._dispatcher = threading.Thread(target=self._dispatch, name='post-process dispatcher', daemon=True)
+        self._dispatcher.start()
+
+    def submit(self, path: str, on_done=None):
+        """Queues the image at path, without waiting. on_done(old path, new path, SHA-256 of the new file)
+        is called, from another thread, once it has been rewritten; not if it was kept as it is or processing failed."""
+        self._queue.put((path, on_done))
+
+    def _dispatch(self):
+        """Dispatcher thread: submits queued paths to the pool as slots free up, until close() queues None."""
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            path, on_done = item
+            self._slots.acquire()
+            try:
+                future = self._pool.submit(process_image, path, self.options)
+            except Exception:
+                self._slots.release()
+                with self._lock:
+                    self.failed += 1
+                continue
+            future.add_done_callback(lambda future, path=path, on_done=on_done: self._done(path, future, on_done))
+
+    def _done(self, path: str, future, on_done):
+        self._slots.release()
+        if future.exception() is not None:
+            with self._lock:
+                self.failed += 1
+            return
+        new_path, before, after, cpu_time, sha256 = future.result()
+        with self._lock:
+            self.processed += 1
+            self.bytes_before += before
+            self.bytes_after += after
+            self.cpu_time += cpu_time
+        if self.metrics is not None:
+            self.metrics.observe('post_process', cpu_time, bytes=before, saved=before - after)
+            self.metrics.count('bytes_saved', before - after)
+        if on_done is not None and sha256 is not None:
+            on_done(path, new_path, sha256)
+
+    def summary(self) -> str:
+        with self._lock:
+            saved = self.bytes_before - self.bytes_after
+            text = 'Post-processed {} images using {:.1f} s of CPU time, saving {:.1f} MB ({:.0%}).\n'.format(
+                self.processed, self.cpu_time, saved / 1024 / 1024, saved / self.bytes_before if self.bytes_before else 0)
+            if self.failed:
+                text += '{} images could not be post-processed and were kept as they are.\n'.format(self.failed)
+            return text
+
+    def close(self):
+        """Waits for the queued images to be processed."""
+        self._queue.put(None)
+        self._dispatcher.join()
+        self._pool.shutdown(wait=True)
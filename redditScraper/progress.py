@@ -0,0 +1,131 @@
+import collections
+import threading
+from collections import namedtuple
+
+# item states, in the order an image goes through them
+QUEUED, ACTIVE, DONE, FAILED = 'queued', 'active', 'done', 'failed'
+ITEM_STATES = (QUEUED, ACTIVE, DONE, FAILED)
+# a job stopped by the user, which can be resumed
+STOPPED = 'stopped'
+FINISHED_STATES = (DONE, FAILED, STOPPED)
+
+# finished jobs kept, with their images, for the session; older ones are dropped, so memory stays bounded
+MAX_FINISHED_JOBS = 20
+
+JobProgress = namedtuple('JobProgress', ['name', 'state', 'queued', 'active', 'done', 'failed', 'bytes'])
+ItemProgress = namedtuple('ItemProgress', ['name', 'url', 'state', 'outcome', 'bytes'])
+
+class ProgressTracker:
+    """Thread-safe record of the progress of every job and every image in it, plus the log messages.
+    Written to by the download threads at any rate; read by a UI that calls drain() on a timer,
+    so however many events there are, the UI only does work once per tick.
+    Updates to the same job or image between two drains are coalesced into one change.
+    Only the last MAX_FINISHED_JOBS jobs that are done, failed or stopped are kept; the log of a long
+    session keeps their summaries."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._log = []
+        self._jobs = {} # key -> [JobProgress, [ItemProgress], job], holding on to the job keeps its id() unique
+        self._job_keys = {} # id(job) -> key
+        self._next_key = 0
+        self._item_rows = {}
+        self._finished = collections.deque() # keys of the finished jobs, in the order they finished
+        self._changes = {}
+        self._new = set() # keys of the jobs added since the last drain
+
+    def report(self, message: str):
+        """Adds text to the log; can be passed as a report callable, e.g. to JobQueue."""
+        with self._lock:
+            self._log.append(message)
+
+    def _job_key(self, job) -> int:
+        key = self._job_keys.get(id(job))
+        if key is None:
+            key = self._job_keys[id(job)] = self._next_key
+            self._next_key += 1
+            self._jobs[key] = [JobProgress(str(job), QUEUED, 0, 0, 0, 0, 0), [], job]
+            self._changes[(key, None)] = self._jobs[key][0]
+            self._new.add(key)
+        return key
+
+    def add_job(self, job):
+        with self._lock:
+            self._job_key(job)
+
+    def set_job_state(self, job, state: str):
+        """'queued', 'active' (fetching the listing and downloading), 'done', 'failed' or 'stopped'."""
+        with self._lock:
+            key = self._job_key(job)
+            self._set_job(key, self._jobs[key][0]._replace(state=state))
+            if state in FINISHED_STATES and key not in self._finished:
+                self._finished.append(key)
+                while len(self._finished) > MAX_FINISHED_JOBS:
+                    self._remove_job(self._finished.popleft())
+
+    def _remove_job(self, key: int):
+        progress, items, job = self._jobs.pop(key)
+        del self._job_keys[id(job)]
+        for item in items:
+            self._item_rows.pop((key, item.name), None)
+        for change in [change for change in self._changes if change[0] == key]:
+            del self._changes[change]
+        if key in self._new: # never drained, so the UI does not know it
+            self._new.discard(key)
+        else:
+            self._changes[(key, None)] = None
+
+    def add_item(self, job, name: str, url: str):
+        """A queued image of job, name being its target filename (unique within a job)."""
+        with self._lock:
+            key = self._job_key(job)
+            items = self._jobs[key][1]
+            self._item_rows[(key, name)] = len(items)
+            items.append(None)
+            self._set_item(key, len(items) - 1, ItemProgress(name, url, QUEUED, None, 0))
+
+    def update_item(self, job, name: str, state: str = None, outcome: str = None, size: int = None):
+        """Moves an image to another state, and/or records its outcome ('downloaded', 'skipped',
+        'near-duplicate', 'failed') or size in bytes."""
+        with self._lock:
+            key = self._job_keys.get(id(job))
+            item_row = self._item_rows.get((key, name))
+            if item_row is None:
+                return
+            item = self._jobs[key][1][item_row]
+            changes = {}
+            if state is not None:
+                changes['state'] = state
+            if outcome is not None:
+                changes['outcome'] = outcome
+            if size is not None:
+                changes['bytes'] = size
+            self._set_item(key, item_row, item._replace(**changes))
+
+    def _set_job(self, key: int, progress: JobProgress):
+        self._jobs[key][0] = progress
+        self._changes[(key, None)] = progress
+
+    def _set_item(self, key: int, item_row: int, item: ItemProgress):
+        old = self._jobs[key][1][item_row]
+        self._jobs[key][1][item_row] = item
+        self._changes[(key, item_row)] = item
+        job = self._jobs[key][0]
+        counts = {state: getattr(job, state) for state in ITEM_STATES}
+        if old is not None:
+            counts[old.state] -= 1
+        counts[item.state] += 1
+        self._set_job(key, job._replace(bytes=job.bytes + item.bytes - (old.bytes if old else 0), **counts))
+
+    def drain(self):
+        """Returns (text, changes): the log text added since the last drain, and a list of
+        (job key, item row or None for the job itself, JobProgress or ItemProgress), in the order
+        the jobs and items were first added, so new rows always come after the ones already seen.
+        A job that was dropped comes as (job key, None, None)."""
+        with self._lock:
+            text = ''.join(self._log)
+            changes = [(key, item_row, value) for (key, item_row), value in self._changes.items()]
+            self._log = []
+            self._changes = {}
+            self._new = set()
+        return text, changes
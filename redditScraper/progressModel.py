@@ -0,0 +1,110 @@
+from PyQt5.QtCore import QAbstractItemModel, QModelIndex, Qt
+from PyQt5.QtGui import QColor
+
+from .progress import DONE, FAILED
+
+COLUMNS = ('Download', 'State', 'Size')
+
+def format_bytes(size: int) -> str:
+    for unit in ('B', 'KB', 'MB'):
+        if size < 1024:
+            return '{:.0f} {}'.format(size, unit)
+        size /= 1024
+    return '{:.1f} GB'.format(size)
+
+class ProgressModel(QAbstractItemModel):
+    """Tree of the jobs (top level) and their images (children), fed with the changes drained from
+    a ProgressTracker. A batch of changes becomes at most one row insertion per parent plus dataChanged
+    signals, and a row removal per job the tracker dropped, so the view keeps up with any number of events."""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.keys = [] # the tracker's key of every job row
+        self.jobs = []
+        self.items = []
+
+    def apply(self, changes: list):
+        """Applies the (job key, item row, value) changes of ProgressTracker.drain."""
+        for key, item_row, value in changes:
+            if value is None and key in self.keys:
+                row = self.keys.index(key)
+                self.beginRemoveRows(QModelIndex(), row, row)
+                del self.keys[row], self.jobs[row], self.items[row]
+                self.endRemoveRows()
+        rows = {key: row for row, key in enumerate(self.keys)}
+        new_jobs = [(key, value) for key, item_row, value in changes
+                    if item_row is None and value is not None and key not in rows]
+        if new_jobs:
+            self.beginInsertRows(QModelIndex(), len(self.jobs), len(self.jobs) + len(new_jobs) - 1)
+            for key, value in new_jobs:
+                rows[key] = len(self.keys)
+                self.keys.append(key)
+                self.jobs.append(value)
+                self.items.append([])
+            self.endInsertRows()
+        new_items = {}
+        for key, item_row, value in changes:
+            if value is None:
+                continue
+            row = rows[key]
+            if item_row is None:
+                self.jobs[row] = value
+                self.dataChanged.emit(self.index(row, 0), self.index(row, len(COLUMNS) - 1))
+            elif item_row >= len(self.items[row]):
+                new_items.setdefault(row, []).append(value)
+            else:
+                self.items[row][item_row] = value
+                parent = self.index(row, 0)
+                self.dataChanged.emit(self.index(item_row, 0, parent), self.index(item_row, len(COLUMNS) - 1, parent))
+        for row, values in new_items.items():
+            first = len(self.items[row])
+            self.beginInsertRows(self.index(row, 0), first, first + len(values) - 1)
+            self.items[row].extend(values)
+            self.endInsertRows()
+
+    def index(self, row: int, column: int, parent: QModelIndex = QModelIndex()) -> QModelIndex:
+        if not self.hasIndex(row, column, parent):
+            return QModelIndex()
+        # internal id 0 marks a job, n + 1 an image of job n
+        return self.createIndex(row, column, parent.row() + 1 if parent.isValid() else 0)
+
+    def parent(self, index: QModelIndex) -> QModelIndex:
+        if not index.isValid() or index.internalId() == 0:
+            return QModelIndex()
+        return self.createIndex(index.internalId() - 1, 0, 0)
+
+    def rowCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        if not parent.isValid():
+            return len(self.jobs)
+        if parent.internalId() == 0 and parent.column() == 0:
+            return len(self.items[parent.row()])
+        return 0
+
+    def columnCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        return len(COLUMNS)
+
+    def headerData(self, section: int, orientation, role: int = Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return COLUMNS[section]
+        return None
+
+    def data(self, index: QModelIndex, role: int = Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        if index.internalId() == 0:
+            job = self.jobs[index.row()]
+            if role == Qt.DisplayRole:
+                return (job.name,
+                        '{}: {} queued, {} active, {} done, {} failed'.format(job.state, job.queued, job.active,
+                                                                             job.done, job.failed),
+                        format_bytes(job.bytes))[index.column()]
+            return None
+        item = self.items[index.internalId() - 1][index.row()]
+        if role == Qt.DisplayRole:
+            state = item.outcome if item.state == DONE and item.outcome else item.state
+            return (item.name, state, format_bytes(item.bytes) if item.bytes else '')[index.column()]
+        if role == Qt.ToolTipRole:
+            return item.url
+        if role == Qt.ForegroundRole and item.state == FAILED:
+            return QColor(Qt.red)
+        return None
@@ -1,22 +1,124 @@
 #reddit image scraper2, using praw
 
-import os, sys
-import requests
-import praw
-from prawcore import NotFound, OAuthException
+# praw, prawcore and requests are imported where they are first needed, which keeps startup
+# of the command line mode fast. Nothing in here may import Qt.
+import os
+import copy
+import tempfile
+import hashlib
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from .credentials import load_credentials
+from .cache import TTLCache, MISSING
+from .metrics import Metrics
+from .resolver import UrlResolver, url_extension
+from .dimensions import image_size, HEADER_BYTES
 
-try:
-    import redditScraper.reddit_secrets as secrets
-except ImportError:
-    print("You need to setup the reddit_secrets.py file with your reddit information!")
-    sys.exit(1)
+CHUNK_SIZE = 64 * 1024
+# image headers are read in PROBE_CHUNK pieces until the size is found, up to HEADER_BYTES
+PROBE_CHUNK = 4 * 1024
+PAGE_SIZE = 100 # the most posts reddit returns for one listing request
+RESOLVE_WORKERS = 8 # links of a listing page resolved at the same time
+ADAPTIVE_LIMIT_MULTIPLIER = 4
+
+SORTINGS = ["Hot", "Top all time", "Top this month", "Top past year", "New", "Controversial"]
+# how long (in seconds) a fetched listing page stays fresh, per sorting
+LISTING_TTL = {"New": 60,
+               "Hot": 300,
+               "Controversial": 600,
+               "Top this month": 3600,
+               "Top past year": 6*3600,
+               "Top all time": 24*3600}
+SUBREDDIT_EXISTS_TTL = 7*24*3600
+SUBREDDIT_MISSING_TTL = 3600
+# known url resolutions rarely change and are small, so many more of them are kept than listing pages
+RESOLUTION_CACHE_ENTRIES = 50000
+# submission attributes kept from the listings, everything downstream only uses these
+POST_FIELDS = ('id', 'name', 'url', 'title', 'score', 'num_comments', 'created_utc', 'permalink', 'domain',
+               'over_18', 'is_video', 'post_hint', 'is_gallery', 'media_metadata', 'gallery_data', 'preview')
+
+ImagePost = namedtuple('ImagePost', ['url', 'post', 'ext', 'width', 'height'], defaults=(None, None))
+DownloadResult = namedtuple('DownloadResult', ['path', 'sha256', 'size'])
+
+class MissingCredentialsError(Exception):
+    pass
+
+def post_record(submission) -> SimpleNamespace:
+    """A plain, picklable copy of the POST_FIELDS of a PRAW submission, with author and subreddit as names.
+    Only the attributes PRAW already has are read, since touching a missing one makes PRAW fetch the post."""
+    data = vars(submission)
+    record = SimpleNamespace(**{field: data.get(field) for field in POST_FIELDS})
+    record.fullname = record.name
+    record.author = str(data['author']) if data.get('author') is not None else None
+    record.subreddit = str(data['subreddit']) if data.get('subreddit') is not None else None
+    return record
+
+def place_file(tmp_path: str, path: str):
+    """Moves the finished file tmp_path to path, raising FileExistsError instead of replacing a file
+    that is already there. A hardlink makes the check and the move one atomic step; where hardlinks
+    are not supported, the file is renamed after checking."""
+    try:
+        os.link(tmp_path, path)
+    except FileExistsError:
+        raise FileExistsError('{} already exists'.format(path)) from None
+    except OSError:
+        if os.path.exists(path):
+            raise FileExistsError('{} already exists'.format(path)) from None
+        os.replace(tmp_path, path)
+        return
+    os.remove(tmp_path)
 
 class redditScraper:
-    """Utility class that interfaces with PRAW, the python bindings for the reddit api."""
-    def __init__(self):
-        self.reddit = praw.Reddit(client_id = secrets.client_id,
-                         client_secret = secrets.client_secret,
-                         user_agent = secrets.user_agent,
+    """Utility class that interfaces with PRAW, the python bindings for the reddit api.
+    The PRAW client is only created when it is first used."""
+    def __init__(self, credentials: dict = None, cache_path: str = None):
+        self.credentials = credentials if credentials is not None else load_credentials()
+        self._local = threading.local()
+        # subreddit existence checks and listing pages, so that fresh data never touches the network
+        self.cache = TTLCache(path=cache_path)
+        # where timings and counters go; a run that wants its own numbers uses a view, see with_metrics
+        self.metrics = Metrics()
+        self.resolver = UrlResolver(TTLCache(RESOLUTION_CACHE_ENTRIES, cache_path, table='resolutions'))
+
+        #dictionary for switching between the sorting options:
+        self.sorting_options = {"Top all time": self.top_all_posts,
+                           "Top this month": self.top_month_posts,
+                            "Top past year":self.top_year_posts,
+                            "New": self.new_posts,
+                            "Controversial": self.controversial_posts,
+                           "Hot": self.hot_posts }
+
+    @property
+    def reddit(self):
+        """The PRAW client for the calling thread. PRAW is not thread safe, so download jobs running
+        in parallel each get their own client; they share one API budget through RateLimitedRequestor."""
+        if not hasattr(self._local, 'reddit'):
+            self._local.reddit = self.create_client()
+        return self._local.reddit
+
+    def with_metrics(self, metrics) -> 'redditScraper':
+        """A view of this scraper that records its timings and counters in metrics. It shares the PRAW
+        clients, the caches and the resolver with this one, so that runs with their own Metrics can overlap."""
+        view = copy.copy(self)
+        view.metrics = metrics
+        return view
+
+    def has_credentials(self) -> bool:
+        return self.credentials is not None
+
+    def create_client(self):
+        """Creates a PRAW client. The credentials can point it at another server with
+        'oauth_url' and 'reddit_url', e.g. the fake reddit of the benchmarks."""
+        if self.credentials is None:
+            raise MissingCredentialsError("You need to setup the reddit_secrets.py file with your reddit information!")
+        import praw
+        from .scheduler import RateLimitedRequestor
+        return praw.Reddit(client_id = self.credentials['client_id'],
+                         client_secret = self.credentials['client_secret'],
+                         user_agent = self.credentials['user_agent'],
                         check_for_updates=False,
                         comment_kind="t1",
                         message_kind="t4",
@@ -24,103 +126,311 @@ class redditScraper:
                         submission_kind="t3",
                         subreddit_kind="t5",
                         trophy_kind="t6",
-                        oauth_url="https://oauth.reddit.com",
-                        reddit_url="https://www.reddit.com",
+                        oauth_url=self.credentials.get('oauth_url') or "https://oauth.reddit.com",
+                        reddit_url=self.credentials.get('reddit_url') or "https://www.reddit.com",
                         short_url="https://redd.it",
                         ratelimit_seconds=5,
                         timeout=16,
+                        requestor_class=RateLimitedRequestor,
                     )
 
-        #dictionary for switching between the sorting options:
-        self.sorting_options = {"Top all time": self.top_all_posts,
-                           "Top this month": self.top_month_posts,
-                            "Top past year":self.top_year_posts,
-                            "New": self.new_posts,
-                            "Controversial": self.controversial_posts,
-                           "Hot": self.hot_posts }
-
 
 ###### All the various options for sorting ############
-    def controversial_posts(self, sub:str, num:int):
+    # extra keyword arguments (e.g. params={'after': ...}) are passed on to the PRAW listing.
+    def controversial_posts(self, sub:str, num:int, **kwargs):
         subreddit=self.reddit.subreddit(sub)
-        return subreddit.controversial(limit=num)
-    def new_posts(self, sub:str, num:int):
+        return subreddit.controversial(limit=num, **kwargs)
+    def new_posts(self, sub:str, num:int, **kwargs):
         subreddit=self.reddit.subreddit(sub)
-        return subreddit.new(limit=num)
-    def top_year_posts(self, sub:str, num:int):
+        return subreddit.new(limit=num, **kwargs)
+    def top_year_posts(self, sub:str, num:int, **kwargs):
         subreddit=self.reddit.subreddit(sub)
-        return subreddit.top(limit=num,time_filter='year')
-    def top_all_posts(self, sub:str, num:int):
+        return subreddit.top(limit=num,time_filter='year', **kwargs)
+    def top_all_posts(self, sub:str, num:int, **kwargs):
         subreddit=self.reddit.subreddit(sub)
-        return subreddit.top(limit=num)
-    def top_month_posts(self,sub:str, num:int):
+        return subreddit.top(limit=num, **kwargs)
+    def top_month_posts(self,sub:str, num:int, **kwargs):
         subreddit=self.reddit.subreddit(sub)
-        return subreddit.top(time_filter='month', limit=num)
-    def hot_posts(self,sub:str, num:int):
+        return subreddit.top(time_filter='month', limit=num, **kwargs)
+    def hot_posts(self,sub:str, num:int, **kwargs):
         subreddit=self.reddit.subreddit(sub)
-        return subreddit.hot( limit = num)
+        return subreddit.hot( limit = num, **kwargs)
 #######################################################
     def sub_exists(self, sub:str) -> bool:
-        """Tests if a given subreddit exists."""
+        """Tests if a given subreddit exists. The answer is cached, for a week if it does."""
+        key = 'exists:' + sub.lower()
+        exists = self.cache.get(key)
+        if exists is not MISSING:
+            return exists
+        from prawcore import NotFound
         exists = True
         try:
             self.reddit.subreddits.search_by_name(sub, exact=True)
         except NotFound:
             exists = False
+        self.cache.set(key, exists, SUBREDDIT_EXISTS_TTL if exists else SUBREDDIT_MISSING_TTL)
         return exists
     def valid_login(self)-> bool:
         """Tests if the provided login information works for logging into reddit."""
+        from prawcore import OAuthException
         try:
             next(self.reddit.subreddit('news').hot())
         except OAuthException:
             return False
         return True
 
-    def handle_imgur_links(self, imgur_link: str) -> str:
-        """A way of extracting the image from an imgur link, which works most of the time.
-        A more proper way would be to use imgur API, but for now I'm too lazy. """
-        l = imgur_link.split('/')
-        return '/'.join([x if x != 'imgur.com' else 'i.imgur.com' for x in l]) + '.jpg'
+    def image_urls(self, post, engine=None) -> list:
+        """Returns the downloadable images of a post record as Resolution(url, ext)s, see UrlResolver.
+        Empty if the post is not an image; a gallery has several. Links that need a request to tell
+        go through the DownloadEngine engine, if given."""
+        return self.resolver.resolve(post, self.metrics, engine)
 
-    def get_image_urls(self, sub: str, sorting:str, num: int, limit: int)-> list :
-        """returns a list of up to num links to images."""
-        posts = self.sorting_options[sorting](sub, limit)
+    def fetch_page(self, sub: str, sorting: str, page_size: int, after: str = None, before: str = None) -> list:
+        """Returns one page of a listing as post records, from the cache if it was fetched
+        recently enough for its sorting (see LISTING_TTL), otherwise with one API request."""
+        key = 'listing:{}:{}:{}:{}:{}'.format(sub.lower(), sorting, page_size, after, before)
+        page = self.cache.get(key)
+        if page is MISSING:
+            with self.metrics.timer('listing_page', subreddit=sub, sorting=sorting):
+                if before:
+                    # one plain request: PRAW's listing generator follows a short 'before' page up with
+                    # a request carrying both cursors, which reddit answers with the same posts again
+                    listing = self.reddit.get('r/{}/new'.format(sub), params={'before': before, 'limit': page_size})
+                    page = [post_record(x) for x in listing]
+                else:
+                    params = {'after': after} if after else {}
+                    page = [post_record(x) for x in self.sorting_options[sorting](sub, page_size, params=params)]
+            self.metrics.count('listing_pages')
+            self.cache.set(key, page, LISTING_TTL[sorting])
+        else:
+            self.metrics.count('listing_pages_cached')
+        return page
+
+    def listing_pages(self, sub: str, sorting: str, first_page: int = PAGE_SIZE):
+        """Yields the posts of a listing one page, i.e. one API request, at a time, following the 'after' cursor.
+        The first page can be made smaller so that the first results arrive sooner."""
+        after = None
+        page_size = min(first_page, PAGE_SIZE)
+        while True:
+            page = self.fetch_page(sub, sorting, page_size, after)
+            if not page:
+                return
+            yield page
+            after = page[-1].fullname
+            page_size = PAGE_SIZE
 
-        urls = [x.url for x in posts]
+    def pages_since(self, sub: str, sorting: str, since: dict):
+        """Yields pages of the posts created after the checkpoint since ({'fullname', 'created_utc'}).
+        New is ordered by time, so it pages forward from the checkpoint with reddit's 'before' cursor,
+        oldest posts first; a short page is the last one. reddit also answers 'before' with nothing once
+        the checkpoint post has been removed, so an empty first page is followed by a one-post request for
+        the newest post: only if that is newer than the checkpoint are the pages scanned by timestamp.
+        When nothing changed, that is two small requests.
+        Other sortings are not ordered by time, so their pages are filtered to posts newer than the
+        checkpoint, stopping at the first page without any."""
+        if sorting == 'New':
+            before = since['fullname']
+            while True:
+                page = self.fetch_page(sub, sorting, PAGE_SIZE, before=before)
+                if not page:
+                    break
+                yield list(reversed(page))
+                if len(page) < PAGE_SIZE: # that was the newest post
+                    return
+                before = page[0].fullname
+            if before != since['fullname']:
+                return
+            newest = self.fetch_page(sub, sorting, 1)
+            if not newest or newest[0].created_utc <= since['created_utc']:
+                return
+            self.metrics.count('checkpoint_resyncs', subreddit=sub)
+        for page in self.listing_pages(sub, sorting):
+            newer = [post for post in page if post.created_utc > since['created_utc']]
+            if not newer:
+                return
+            yield newer
 
-        image_urls = []
-        for i in range(len(urls)):
-            if len(image_urls) >= num: break
+    def iter_image_posts(self, sub: str, sorting: str, num: int, limit: int, stats: dict = None, since: dict = None,
+                         size_filter=None, engine=None):
+        """Lazily yields ImagePost(url, post, ext, width, height) for up to num images, as the listing pages arrive.
+        Paging stops as soon as num images are found. If limit posts have been scanned without finding
+        num images, paging goes on (up to ADAPTIVE_LIMIT_MULTIPLIER*limit posts) as long as the listing
+        has produced some images at all. With a checkpoint since, only posts newer than it are looked at,
+        see pages_since; outside New, which is the only listing in time order, that is every newer post,
+        whatever num and limit are, since a checkpoint skips all posts older than the newest one scanned.
+        Images whose size the post's metadata has and that a SizeFilter size_filter rejects are left out,
+        and don't count towards num; those without a size are yielded, to be checked when downloading.
+        The posts of a page are resolved on RESOLVE_WORKERS threads, so a link that needs a request (through
+        the DownloadEngine engine, if given) only holds up the posts after it until its answer arrives.
+        If given, stats['scanned'], stats['pages'] and stats['filtered'] are kept up to date, and
+        stats['newest'] is set to the checkpoint of the newest post scanned."""
+        stats = stats if stats is not None else {}
+        stats['scanned'] = stats['pages'] = stats['filtered'] = 0
+        stats['newest'] = None
+        if num <= 0:
+            return
+        found = seen = 0
+        exhaustive = since is not None and sorting != 'New'
+        pages = self.listing_pages(sub, sorting, first_page=limit) if since is None else self.pages_since(sub, sorting, since)
+        with ThreadPoolExecutor(RESOLVE_WORKERS) as pool:
+            for page in pages:
+                stats['pages'] += 1
+                resolving = [pool.submit(self.image_urls, post, engine) for post in page]
+                try:
+                    for post, resolution in zip(page, resolving):
+                        stats['scanned'] += 1
+                        self.metrics.count('posts_scanned')
+                        if stats['newest'] is None or post.created_utc > stats['newest']['created_utc']:
+                            stats['newest'] = {'fullname': post.fullname, 'created_utc': post.created_utc}
+                        for url, ext, width, height in resolution.result():
+                            seen += 1
+                            if size_filter and width and height and not size_filter.accepts(width, height):
+                                stats['filtered'] += 1
+                                self.metrics.count('filtered', subreddit=sub)
+                                continue
+                            self.metrics.count('images_found')
+                            yield ImagePost(url, post, ext, width, height)
+                            found += 1
+                            if found >= num and not exhaustive:
+                                return
+                finally:
+                    for future in resolving: # the rest of the page, once the images are found or the listing is dropped
+                        future.cancel()
+                if exhaustive:
+                    continue
+                if stats['scanned'] >= limit and (seen == 0 or stats['scanned'] >= limit*ADAPTIVE_LIMIT_MULTIPLIER):
+                    return
 
-            if urls[i][-4:] == '.jpg' or urls[i][-4:] == '.png' or urls[i][-4:] == '.gif':
-                image_urls.append(urls[i])
-            elif 'imgur.com' in urls[i].split('/'):
-                image_urls.append(self.handle_imgur_links(urls[i]))
-        return image_urls
+    def get_image_urls(self, sub: str, sorting:str, num: int, limit: int)-> list :
+        """returns a list of up to num links to images."""
+        return [image.url for image in self.iter_image_posts(sub, sorting, num, limit)]
 
-    def download_image(self, url: str, filename: str, folder: str):
-        """Downloads the image, saves it as 'filename'+('.jpg' or '.png'), in the specified folder"""
+    def probe_size(self, url: str, engine=None) -> tuple:
+        """Returns the (width, height) of the image at url without downloading it, by asking for the first
+        HEADER_BYTES with a Range request and parsing its header; the connection is closed as soon as the
+        size is known. Returns None if it could not be found out."""
+        headers = {'Range': 'bytes=0-{}'.format(HEADER_BYTES - 1)}
+        data = b''
+        try:
+            with self.metrics.timer('probe') as fields:
+                if engine is not None:
+                    context = engine.open(url, headers=headers)
+                else:
+                    import requests
+                    context = requests.get(url, headers=headers, stream=True, timeout=16)
+                with context as response:
+                    response.raise_for_status()
+                    for chunk in response.iter_content(PROBE_CHUNK):
+                        data += chunk
+                        size = image_size(data)
+                        if size is not None or len(data) >= HEADER_BYTES:
+                            break
+                fields['bytes'] = len(data)
+        except Exception:
+            return None
+        self.metrics.count('probe_bytes', len(data))
+        return image_size(data)
+
+    def download_image(self, url: str, filename: str, folder: str, engine=None, max_bytes: int = None,
+                       ext: str = None) -> DownloadResult:
+        """Downloads the image, saves it as 'filename'.ext in the specified folder; ext defaults to the url's extension.
+        If a DownloadEngine is given, the request goes through its pooled session and per-host limits.
+        The body is streamed to a temporary file which is only renamed into place once complete,
+        so a failed download never leaves a truncated image behind. An existing file is never replaced,
+        since the DedupIndex may have it recorded for another url; the download fails instead.
+        Returns a DownloadResult(path, sha256, size), or None if nothing was saved."""
         if not os.path.exists(folder):
-            os.makedirs(folder)
-        if url[-4:] == '.jpg' or url[-4:] == '.png' or url[-4:] == '.gif':
+            os.makedirs(folder, exist_ok=True)
+        ext = ext or url_extension(url)
+        if ext is not None:
+            path = os.path.join(folder, filename + '.' + ext)
             try:
-                img_data = requests.get(url).content
-                with open(folder + '\\' + filename + url[-4:], 'wb') as handler:
-                    handler.write(img_data)
+                with self.metrics.timer('download') as fields:
+                    if engine is not None:
+                        with engine.open(url) as response:
+                            result = self.stream_to_file(response, path, max_bytes)
+                    else:
+                        import requests
+                        with requests.get(url, stream=True, timeout=16) as response:
+                            result = self.stream_to_file(response, path, max_bytes)
+                    fields['bytes'] = result.size
+                self.metrics.count('bytes', result.size)
+                return result
             except Exception as e:
                 print("Failed to download {}".format(url))
                 print("Exception: {}".format(e))
+        return None
 
-    def download_images_print(self, sub: str, sorting:str, num: int, limit:int, base_folder:str):
-        """Downloads the selected images into base_folder/subreddit.
-        Can be used in the console to test that this redditScraper class works as intended. """
-        img_urls = self.get_image_urls(sub, sorting, num, limit)
+    def stream_to_file(self, response, path: str, max_bytes: int = None) -> DownloadResult:
+        """Copies the response body to path in CHUNK_SIZE pieces via a temp file in the same folder,
+        hashing it on the way, then atomically moves it into place, see place_file.
+        Raises before reading the body if the server says it is not an image, if the body exceeds
+        max_bytes or does not match Content-Length, and FileExistsError if path already exists."""
+        response.raise_for_status()
+        content_type = response.headers.get('Content-Type', '')
+        if content_type and not content_type.startswith(('image/', 'application/octet-stream')):
+            raise ValueError('not an image but {}'.format(content_type))
+        expected = response.headers.get('Content-Length')
+        expected = int(expected) if expected and expected.isdigit() else None
+        if response.headers.get('Content-Encoding', 'identity') != 'identity':
+            expected = None # iter_content decodes the body, so the sizes will not match
+        if max_bytes is not None and expected is not None and expected > max_bytes:
+            raise ValueError('image is {} bytes, larger than the {} byte limit'.format(expected, max_bytes))
 
-        folder = os.path.join(base_folder, sub)
+        folder, name = os.path.split(path)
+        fd, tmp_path = tempfile.mkstemp(prefix='.' + name + '.', suffix='.part', dir=folder)
+        try:
+            written = 0
+            write_time = 0.0
+            digest = hashlib.sha256()
+            with os.fdopen(fd, 'wb') as handler:
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    written += len(chunk)
+                    if max_bytes is not None and written > max_bytes:
+                        raise ValueError('image is larger than the {} byte limit'.format(max_bytes))
+                    digest.update(chunk)
+                    started = time.perf_counter()
+                    handler.write(chunk)
+                    write_time += time.perf_counter() - started
+            self.metrics.observe('disk_write', write_time, bytes=written)
+            if expected is not None and written != expected:
+                raise IOError('truncated download: got {} of {} bytes'.format(written, expected))
+            place_file(tmp_path, path)
+            return DownloadResult(path, digest.hexdigest(), written)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
 
-        print( 'Downloading '+ str(len(img_urls)) + ' images from ' + sub +', sorted by ' +sorting  )
-        for i, url in enumerate(img_urls):
-            filename = sub + str(i + 1)
-            self.download_image(url, filename, folder)
-            print(str(i), end=" ")
-        print('Finished!' )
+    def download_images_print(self, sub, sorting:str, num: int, limit:int, base_folder:str,
+                              workers: int = 8, concurrent_jobs: int = 4, **job_options):
+        """Downloads the selected images into base_folder/subreddit, printing the progress.
+        sub can also be a list of subreddits, which are then downloaded concurrently through a JobQueue.
+        Can be used in the console to test that this redditScraper class works as intended,
+        and is what the command line mode runs. Extra keyword arguments are passed on to DownloadJob."""
+        from .downloadJob import DownloadJob
+
+        subs = [sub] if isinstance(sub, str) else list(sub)
+        return self.run_jobs([DownloadJob(s, num, limit, sorting, **job_options) for s in subs], base_folder,
+                             workers, concurrent_jobs)
+
+    def run_jobs(self, jobs: list, base_folder: str, workers: int = 8, concurrent_jobs: int = 4,
+                 post_process=None, metrics=None) -> list:
+        """Runs DownloadJobs through a JobQueue, printing the progress. Ctrl+C stops them cleanly:
+        downloads in progress finish, and the jobs can be resumed later.
+        post_process are the PostProcessOptions for the downloaded images, if any, and metrics
+        the Metrics to record the run in (a fresh one if None).
+        Returns the outcome Counter of every job, None for the ones that failed."""
+        from .scheduler import JobQueue
+
+        report = lambda message: print(message, end='', flush=True)
+        with JobQueue(self, base_folder, workers, concurrent_jobs, report=report, post_process=post_process,
+                      metrics=metrics) as queue:
+            futures = [queue.add(job) for job in jobs]
+            try:
+                queue.join()
+            except KeyboardInterrupt:
+                print('\nStopping, waiting for the downloads in progress ...', flush=True)
+                queue.cancel()
+        print('Stopped.' if queue.cancelled.is_set() else 'Finished!')
+        return [f.result() if f.exception() is None else None for f in futures]
@@ -0,0 +1,148 @@
+import html
+import threading
+from collections import namedtuple
+from urllib.parse import urlsplit
+
+from .cache import MISSING
+
+EXTENSION_ALIASES = {'jpeg': 'jpg', 'jpg': 'jpg', 'png': 'png', 'gif': 'gif', 'webp': 'webp'}
+MIME_EXTENSIONS = {'image/jpeg': 'jpg', 'image/jpg': 'jpg', 'image/png': 'png', 'image/gif': 'gif', 'image/webp': 'webp'}
+# links to these never lead to a still image, so they are not worth a request
+NON_IMAGE_DOMAINS = {'v.redd.it', 'reddit.com', 'www.reddit.com', 'old.reddit.com', 'youtube.com', 'www.youtube.com',
+                     'youtu.be', 'gfycat.com', 'redgifs.com', 'www.redgifs.com', 'streamable.com', 'twitter.com'}
+RESOLUTION_TTL = 30*24*3600
+SNIFF_BYTES = 32
+
+# width and height are set when the post's metadata (gallery or preview) has them
+Resolution = namedtuple('Resolution', ['url', 'ext', 'width', 'height'], defaults=(None, None))
+
+def sniff_image_type(data: bytes) -> str:
+    """The image type of a file from its first bytes (magic numbers), or None if it is not an image we handle."""
+    if data[:3] == b'\xff\xd8\xff':
+        return 'jpg'
+    if data[:8] == b'\x89PNG\r\n\x1a\n':
+        return 'png'
+    if data[:6] in (b'GIF87a', b'GIF89a'):
+        return 'gif'
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
+def url_extension(url: str) -> str:
+    """The image extension of url's path (ignoring the query), or None."""
+    path = urlsplit(url).path
+    if '.' not in path.rsplit('/', 1)[-1]:
+        return None
+    return EXTENSION_ALIASES.get(path.rsplit('.', 1)[-1].lower())
+
+class UrlResolver:
+    """Works out which images a post links to, replacing the old suffix checks.
+    Uses the post's own metadata where possible (gallery media_metadata, preview sources, the url's extension),
+    and only for unknown links asks the server, with a request for the first few bytes of the file.
+    Network resolutions are stored in a TTLCache, so every url is resolved once."""
+
+    def __init__(self, cache, timeout: float = 8):
+        self.cache = cache
+        self.timeout = timeout
+        self._session = None
+        self._lock = threading.Lock()
+
+    def resolve(self, post, metrics, engine=None) -> list:
+        """Returns a list of Resolution(url, ext, width, height) for the images of a post record; empty if it has none.
+        Requests for unknown links go through the DownloadEngine engine, if given, see sniff."""
+        with metrics.timer('resolve'):
+            if post.is_gallery and post.media_metadata:
+                return self.gallery_images(post)
+            url = post.url or ''
+            domain = urlsplit(url).netloc.lower()
+            if domain.startswith('self.') or domain in NON_IMAGE_DOMAINS or post.is_video:
+                return []
+            ext = url_extension(url)
+            if ext is not None:
+                return [Resolution(url, ext, *self.size_from_preview(post))]
+            if url.endswith('.gifv'):
+                # imgur's gifv pages are mp4 videos, the same animation is also served as a gif
+                return [Resolution(url[:-len('.gifv')] + '.gif', 'gif')]
+            if domain.endswith('imgur.com') and ('/a/' in url or '/gallery/' in url):
+                # albums need the imgur API, but reddit's preview has the cover image
+                return self.preview_image(post)
+            if domain == 'imgur.com' or domain == 'm.imgur.com':
+                # imgur serves a single image with its real type, whatever extension is asked for
+                url = 'https://i.imgur.com' + urlsplit(url).path + '.jpg'
+            resolution = self.sniff(url, metrics, engine)
+            if resolution is None and post.post_hint == 'image':
+                return self.preview_image(post)
+            return [resolution] if resolution is not None else []
+
+    def gallery_images(self, post) -> list:
+        """The images of a reddit gallery, in gallery order, from media_metadata."""
+        order = [item['media_id'] for item in (post.gallery_data or {}).get('items', [])] or list(post.media_metadata)
+        images = []
+        for media_id in order:
+            meta = post.media_metadata.get(media_id, {})
+            if meta.get('status') != 'valid' or 's' not in meta:
+                continue
+            size = (meta['s'].get('x'), meta['s'].get('y'))
+            if meta.get('e') == 'AnimatedImage' and 'gif' in meta['s']:
+                images.append(Resolution(html.unescape(meta['s']['gif']), 'gif', *size))
+            elif meta.get('e') == 'Image' and 'u' in meta['s']:
+                ext = MIME_EXTENSIONS.get(meta.get('m')) or url_extension(meta['s']['u']) or 'jpg'
+                images.append(Resolution(html.unescape(meta['s']['u']), ext, *size))
+        return images
+
+    def preview_image(self, post) -> list:
+        """The full size source image of reddit's preview, if the post has one."""
+        try:
+            source = post.preview['images'][0]['source']
+        except (TypeError, KeyError, IndexError):
+            return []
+        url = html.unescape(source['url'])
+        return [Resolution(url, url_extension(url) or 'jpg', source.get('width'), source.get('height'))]
+
+    def size_from_preview(self, post) -> tuple:
+        """(width, height) of the source image of reddit's preview of an image post, which is the linked image
+        itself; (None, None) when there is none."""
+        try:
+            source = post.preview['images'][0]['source']
+        except (TypeError, KeyError, IndexError):
+            return None, None
+        if post.post_hint != 'image':
+            return None, None
+        return source.get('width'), source.get('height')
+
+    def sniff(self, url: str, metrics, engine=None) -> Resolution:
+        """Asks the server what url is, with one request for its first SNIFF_BYTES: the Content-Type,
+        or, if that does not tell, the magic number in those bytes. With a DownloadEngine, the request goes
+        through its pooled session, per-host limits and retries. The answer is cached, also when it is not an image."""
+        key = 'resolve:' + url
+        cached = self.cache.get(key)
+        if cached is not MISSING:
+            metrics.count('resolve_cached')
+            return Resolution(*cached) if cached else None
+        resolution = None
+        headers = {'Range': 'bytes=0-{}'.format(SNIFF_BYTES - 1)}
+        try:
+            if engine is not None:
+                context = engine.open(url, headers=headers)
+            else:
+                context = self.session().get(url, headers=headers, stream=True, timeout=self.timeout)
+            with context as response:
+                content_type = response.headers.get('Content-Type', '').split(';')[0].strip().lower()
+                ext = MIME_EXTENSIONS.get(content_type) if response.ok else None
+                if response.ok and ext is None:
+                    ext = url_extension(response.url) if content_type.startswith('image/') else \
+                        sniff_image_type(response.raw.read(SNIFF_BYTES))
+                if ext is not None:
+                    resolution = Resolution(response.url, ext)
+        except Exception:
+            return None # don't cache network errors
+        metrics.count('resolve_requests')
+        self.cache.set(key, tuple(resolution) if resolution else None, RESOLUTION_TTL)
+        return resolution
+
+    def session(self):
+        with self._lock:
+            if self._session is None:
+                import requests
+                self._session = requests.Session()
+            return self._session
@@ -0,0 +1,168 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from prawcore import Requestor
+
+from .dedupIndex import DedupIndex
+from .catalog import Catalog
+from .dimensions import read_image_size
+from .downloadEngine import DownloadEngine
+from .metrics import Metrics
+from .progress import ACTIVE, DONE, FAILED, STOPPED
+
+REDDIT_REQUESTS_PER_MINUTE = 60 # reddit allows 100 per minute for an OAuth client, this leaves some headroom
+
+class TokenBucket:
+    """Thread-safe token bucket: allows bursts of up to capacity calls, and rate calls per second on average."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Takes one token, blocking until one is available."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait_time = (1 - self._tokens) / self.rate
+            time.sleep(wait_time)
+
+# shared by every PRAW client in the process, so all listing fetches draw from one API budget
+REDDIT_API_BUDGET = TokenBucket(REDDIT_REQUESTS_PER_MINUTE / 60, capacity=10)
+
+class RateLimitedRequestor(Requestor):
+    """prawcore Requestor that takes a token from REDDIT_API_BUDGET before every reddit API request.
+    Passed to praw.Reddit as requestor_class."""
+
+    first_request_at = None # time.perf_counter() of the process's first reddit request, for startup timing
+
+    def request(self, *args, **kwargs):
+        REDDIT_API_BUDGET.acquire()
+        if RateLimitedRequestor.first_request_at is None:
+            RateLimitedRequestor.first_request_at = time.perf_counter()
+        return super().request(*args, **kwargs)
+
+class JobQueue:
+    """Runs many DownloadJobs into one base folder concurrently.
+    Up to concurrent_jobs listings are fetched at the same time (all rate limited through REDDIT_API_BUDGET),
+    and the images of every job go to one shared DownloadEngine, so the per-host limits hold across jobs.
+    Jobs can be added while others are running. Timings and counters are recorded in the queue's own
+    metrics (a fresh Metrics unless one is given), whose summary is reported when the queue is closed. With a ProgressTracker, the state of every
+    job and image is kept up to date in it. cancel() stops all jobs cooperatively, see DownloadJob.run.
+    With PostProcessOptions, every new image is re-encoded and/or resized by a PostProcessor
+    once it is downloaded, and the space saved is reported along with the metrics.
+    Every image kept is recorded in the base folder's Catalog."""
+
+    def __init__(self, scraper, base_folder: str, workers: int = 8, concurrent_jobs: int = 4, report=print,
+                 progress=None, post_process=None, metrics=None):
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.scraper = scraper.with_metrics(self.metrics)
+        self.base_folder = base_folder
+        self.report = report
+        self.progress = progress
+        self.cancelled = threading.Event()
+        self.index = DedupIndex(base_folder)
+        self.catalog = Catalog(base_folder)
+        self._phashes = None
+        self.engine = DownloadEngine(workers=workers, metrics=self.metrics)
+        self.post_processor = None
+        if post_process:
+            from .postProcess import PostProcessor
+            self.post_processor = PostProcessor(post_process, metrics=self.metrics)
+        self._jobs = ThreadPoolExecutor(max_workers=concurrent_jobs)
+        self._futures = []
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def phashes(self):
+        """The perceptual hash index, loaded (along with numpy and Pillow) when the first image needs it."""
+        with self._lock:
+            if self._phashes is None:
+                from .perceptualHash import PerceptualIndex
+                self._phashes = PerceptualIndex(self.base_folder)
+            return self._phashes
+
+    def add(self, job):
+        """Queues a job, returns a Future for its outcome Counter."""
+        if self.progress is not None:
+            self.progress.add_job(job)
+        future = self._jobs.submit(self._run, job)
+        with self._lock:
+            self._futures.append(future)
+        return future
+
+    def _run(self, job):
+        self.report('Downloading {} ...\n'.format(job))
+        self._set_state(job, ACTIVE)
+        try:
+            outcomes = job.run(self.scraper, self.base_folder, self.engine, self.index, lambda: self.phashes,
+                               self.report, self.progress, self.cancelled,
+                               self.post_process if self.post_processor is not None else None, self.catalog)
+        except Exception as e:
+            self.report('{} failed: {}\n'.format(job, e))
+            self._set_state(job, FAILED)
+            raise
+        self._set_state(job, STOPPED if self.cancelled.is_set() else DONE)
+        return outcomes
+
+    def post_process(self, path: str):
+        """Queues a downloaded image for the post processor; the indexes follow it when it is rewritten."""
+        self.post_processor.submit(path, self._rewritten)
+
+    def _rewritten(self, old_path: str, new_path: str, sha256: str):
+        """Brings the indexes up to date with an image the post processor rewrote, at new_path
+        (which may be old_path) with new content and possibly a new size."""
+        self.index.move(old_path, new_path, sha256)
+        self.catalog.move(old_path, new_path, *(read_image_size(new_path) or (None, None)))
+        if new_path == old_path:
+            return
+        with self._lock:
+            phashes = self._phashes
+        if phashes is not None:
+            phashes.move(old_path, new_path)
+
+    def _set_state(self, job, state: str):
+        if self.progress is not None:
+            self.progress.set_job_state(job, state)
+
+    def cancel(self):
+        """Stops listing and starting downloads in every job, queued ones included; downloads
+        in progress finish. The stopped jobs can be resumed from their manifests."""
+        self.cancelled.set()
+
+    def join(self):
+        """Waits until every job has finished, including jobs added while waiting."""
+        while True:
+            with self._lock:
+                pending = [f for f in self._futures if not f.done()]
+            if not pending:
+                return
+            wait(pending)
+
+    def close(self):
+        self.join()
+        self._jobs.shutdown()
+        self.engine.close()
+        if self.post_processor is not None:
+            self.post_processor.close()
+            self.report(self.post_processor.summary())
+        if self._phashes is not None:
+            self._phashes.save()
+        self.catalog.close()
+        self.index.close()
+        self.report(self.metrics.summary())
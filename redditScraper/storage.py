@@ -0,0 +1,9 @@
+import os
+
+STATE_FOLDER_NAME = '.redditScraper'
+
+def state_folder(base_folder: str) -> str:
+    """The folder under base_folder where the scraper keeps its indexes and caches. Created if needed."""
+    folder = os.path.join(base_folder, STATE_FOLDER_NAME)
+    os.makedirs(folder, exist_ok=True)
+    return folder
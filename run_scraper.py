@@ -1,8 +1,10 @@
 import sys
+from multiprocessing import freeze_support
 from redditScraper.RedditScraperGUI import RedditScraperWindow
 from PyQt5.QtWidgets import QApplication
 
 if __name__ == '__main__':
+    freeze_support()
     app = QApplication(sys.argv)
     ex = RedditScraperWindow()
     sys.exit(app.exec_())
\ No newline at end of file